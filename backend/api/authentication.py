@@ -0,0 +1,106 @@
+"""Аутентификация по токену с кэшем пользователей.
+
+TokenAuthentication на каждый запрос выбирает токен вместе с
+пользователем. Здесь результат хранится в ограниченном LRU процесса, и
+запрос с известным токеном обходится без БД.
+
+Записи помечаются поколением auth-tokens (recipes/generations.py),
+прочитанным до обращения к БД, и годятся, только пока оно не сменилось
+и не истек AUTH_TOKEN_CACHE_TIMEOUT. Сигналы меняют поколение после
+выхода (удаления токена), смены пароля, деактивации и других изменений
+пользователя, и это сразу видят все процессы. Проверка поколения стоит
+одного stat() или, если задан GENERATIONS_CACHE, одного чтения из
+общего кэша. Поколение общее: выход одного пользователя сбрасывает
+записи всех, и следующий запрос каждого токена снова идет в БД.
+
+AUTH_TOKEN_CACHE_SIZE=0 выключает кэш.
+
+Небезопасные методы всегда читают пользователя из БД: такие запросы
+могут сохранить request.user целиком, и снимок из кэша с устаревшими
+счетчиками не должен попасть в базу.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+
+from recipes.generations import Generation
+
+
+class TokenCache:
+    """LRU процесса токен → пользователь, сверяемый с поколением."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self.generation = Generation("auth-tokens")
+
+    @property
+    def enabled(self):
+        return settings.AUTH_TOKEN_CACHE_SIZE > 0
+
+    def version(self):
+        """Текущее поколение; меняется при каждом revoke()."""
+        return self.generation.current()
+
+    def revoke(self):
+        """Меняет поколение: записи во всех процессах неактуальны."""
+        self.generation.bump()
+        with self._lock:
+            self._users.clear()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._users.get(key)
+            if entry is None:
+                return None
+            user, entry_version, expires = entry
+            if entry_version == version and expires > time.monotonic():
+                self._users.move_to_end(key)
+                return user
+            del self._users[key]
+        return None
+
+    def set(self, key, user, version):
+        """Запоминает пользователя, прочитанного при версии version."""
+        with self._lock:
+            self._users[key] = (
+                user,
+                version,
+                time.monotonic() + settings.AUTH_TOKEN_CACHE_TIMEOUT,
+            )
+            self._users.move_to_end(key)
+            while len(self._users) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self._users.popitem(last=False)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, которая не ходит в БД за известным токеном."""
+
+    def authenticate(self, request):
+        self.cacheable = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not token_cache.enabled:
+            return super().authenticate_credentials(key)
+        # Поколение берется до чтения из БД: если токен отзовут после
+        # этого, новое поколение не совпадет и запись не пригодится.
+        version = token_cache.version()
+        if self.cacheable:
+            user = token_cache.get(key, version)
+            if user is not None:
+                user = copy.copy(user)
+                return user, Token(key=key, user=user)
+
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, version)
+        return user, token
@@ -0,0 +1,313 @@
+"""Готовые JSON-ответы для справочников (теги, ингредиенты).
+
+Тело ответа сериализуется один раз, сжимается gzip и brotli и
+сохраняется в файл, общий для всех воркеров хоста. Файл помечен
+поколением данных из recipes.generations: пока сигнал об изменении
+данных не сменил поколение, запрос отдается из памяти процесса, а
+If-None-Match отвечается 304 без обращения к БД.
+
+Для рецептов тело зависит от пользователя, поэтому вместо готового
+тела используется conditional_response(): ETag строится по отметкам
+изменения, которые поддерживают сигналы, и 304 отдается без выборки
+и сериализации.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+import brotli
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import (IngredientSerializer, RecipeReadSerializer,
+                             TagSerializer)
+from recipes.generations import Generation
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+
+ENCODINGS = (
+    ("br", brotli.compress),
+    ("gzip", gzip.compress),
+)
+
+
+def preferred_encoding(header):
+    """Кодировка из ENCODINGS с наибольшим q в Accept-Encoding.
+
+    q=0 запрещает кодировку, «*» задает q для неназванных. При равных q
+    выигрывает более ранняя в ENCODINGS; если ни одна не разрешена,
+    тело отдается без сжатия.
+    """
+    weights = {}
+    for item in header.split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.lower()] = weight
+    default = weights.get("*", 0.0)
+    weight, _, encoding = max(
+        (weights.get(name, default), -index, name)
+        for index, (name, _) in enumerate(ENCODINGS)
+    )
+    return encoding if weight > 0 else "identity"
+
+
+class _Payload:
+    """Одна версия тела ответа во всех кодировках."""
+
+    def __init__(self, file):
+        header = json.loads(file.readline())
+        self.version = header["version"]
+        self.generation = header["generation"]
+        self.bodies = {
+            encoding: file.read(size)
+            for encoding, size in header["sizes"].items()
+        }
+
+    @cached_property
+    def data(self):
+        return json.loads(self.bodies["identity"])
+
+    def etag(self, encoding):
+        if encoding == "identity":
+            return quote_etag(self.version)
+        return quote_etag(f"{self.version}-{encoding}")
+
+
+class PrebuiltJSONResponse:
+    """Предсобранный JSON-ответ, который перестраивается после сброса."""
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build_data = build
+        self.generation = Generation(f"prebuilt-response-{name}")
+        self._lock = threading.Lock()
+        self._payload = None
+
+    @property
+    def path(self):
+        return os.path.join(
+            settings.PREBUILT_RESPONSES_DIR, f"{self.name}.bin"
+        )
+
+    def build(self, generation):
+        """Сериализует данные и атомарно записывает все варианты тела.
+
+        Файл сохраняется, только если за время сборки поколение не
+        сменилось; собранное тело возвращается в любом случае.
+        """
+        body = JSONRenderer().render(self.build_data())
+        bodies = {"identity": body}
+        for encoding, compress in ENCODINGS:
+            bodies[encoding] = compress(body)
+        header = {
+            "version": hashlib.sha256(body).hexdigest()[:32],
+            "generation": generation,
+            "sizes": {
+                encoding: len(data) for encoding, data in bodies.items()
+            },
+        }
+        content = b"".join(
+            [json.dumps(header).encode() + b"\n", *bodies.values()]
+        )
+
+        if generation == self.generation.current():
+            os.makedirs(settings.PREBUILT_RESPONSES_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=settings.PREBUILT_RESPONSES_DIR, suffix=".tmp"
+            )
+            with os.fdopen(fd, "wb") as file:
+                file.write(content)
+            os.replace(tmp_path, self.path)
+        return _Payload(io.BytesIO(content))
+
+    def invalidate(self):
+        """Сбрасывает тело на всех хостах: оно соберется при запросе."""
+        self.generation.bump()
+
+    def payload(self):
+        generation = self.generation.current()
+        payload = self._payload
+        if payload is not None and payload.generation == generation:
+            return payload
+
+        with self._lock:
+            payload = self._payload
+            if payload is None or payload.generation != generation:
+                try:
+                    with open(self.path, "rb") as file:
+                        payload = _Payload(file)
+                except (FileNotFoundError, KeyError, ValueError):
+                    payload = None
+            if payload is None or payload.generation != generation:
+                payload = self.build(generation)
+            self._payload = payload
+            return payload
+
+    def response(self, request):
+        """Ответ с учетом Accept-Encoding и If-None-Match."""
+        payload = self.payload()
+        encoding = preferred_encoding(
+            request.headers.get("Accept-Encoding", "")
+        )
+        etag = payload.etag(encoding)
+        known = {payload.etag(name) for name in payload.bodies}
+        etags = set(parse_etags(request.headers.get("If-None-Match", "")))
+
+        if "*" in etags or known & etags:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                payload.bodies[encoding],
+                content_type="application/json",
+            )
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        response[
+            "Cache-Control"
+        ] = f"public, max-age={settings.REFERENCE_CACHE_MAX_AGE}"
+        response["Vary"] = "Accept-Encoding"
+        return response
+
+
+def conditional_response(request, version, render, last_modified=True):
+    """Ответ 304 по версии данных без вызова render().
+
+    version — кортеж значений, от которых зависит тело ответа: из него
+    строится ETag, а самая поздняя из дат в нем идет в Last-Modified.
+    last_modified=False отключает Last-Modified, если даты в версии не
+    сдвигаются при каждом изменении тела (например, при удалении).
+    Ответ зависит от пользователя, поэтому кэшировать его можно только
+    в клиенте и с перепроверкой.
+    """
+    if last_modified:
+        last_modified = max(
+            (value for value in version if isinstance(value, datetime)),
+            default=None,
+        )
+    etag = quote_etag(hashlib.md5(repr(version).encode()).hexdigest())
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        response = render()
+        if response.status_code != 200:
+            return response
+    response["ETag"] = etag
+    if timestamp is not None:
+        response["Last-Modified"] = http_date(timestamp)
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ("Authorization",))
+    return response
+
+
+class RecipeFragments:
+    """Кэш общей для всех пользователей части RecipeReadSerializer.
+
+    Фрагмент сериализуется без запроса, то есть с is_favorited,
+    is_in_shopping_cart и author.is_subscribed равными False, и хранится
+    под ключом из id и updated_at рецепта: любое изменение рецепта дает
+    новый ключ, а старый истекает по TIMEOUT. Хранилище задается
+    алиасом в CACHES, поэтому подходит любой бэкенд Django.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def key(recipe):
+        return f"recipe:{recipe.pk}:{recipe.updated_at.timestamp()}"
+
+    def build(self, ids):
+        recipes = Recipe.objects.filter(pk__in=ids).prefetch_related(
+            "tags",
+            Prefetch(
+                "recipe_ingredients",
+                queryset=IngredientRecipe.objects.select_related("ingredient"),
+            ),
+            "author",
+        )
+        built = {
+            recipe.pk: (self.key(recipe), RecipeReadSerializer(recipe).data)
+            for recipe in recipes
+        }
+        self.cache.set_many(dict(built.values()))
+        return {pk: fragment for pk, (_, fragment) in built.items()}
+
+    def render(self, recipes):
+        """Данные для списка рецептов с отметками текущего пользователя.
+
+        У рецептов должны быть аннотации is_favorited,
+        is_in_shopping_cart и is_subscribed (подписка на автора).
+        """
+        keys = {recipe.pk: self.key(recipe) for recipe in recipes}
+        cached = self.cache.get_many(keys.values())
+        fragments = {
+            pk: cached[key] for pk, key in keys.items() if key in cached
+        }
+        missing = keys.keys() - fragments.keys()
+        if missing:
+            fragments.update(self.build(missing))
+
+        data = []
+        for recipe in recipes:
+            fragment = fragments.get(recipe.pk)
+            if fragment is None:
+                continue
+            fragment = dict(fragment)
+            fragment["author"] = {
+                **fragment["author"],
+                "is_subscribed": recipe.is_subscribed,
+            }
+            fragment["is_favorited"] = recipe.is_favorited
+            fragment["is_in_shopping_cart"] = recipe.is_in_shopping_cart
+            data.append(fragment)
+        return data
+
+
+def build_tags():
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def build_ingredients():
+    return IngredientSerializer(Ingredient.objects.all(), many=True).data
+
+
+tags_response = PrebuiltJSONResponse("tags", build_tags)
+
+
+def tag_ids():
+    """Словарь slug → id из готового ответа со списком тегов.
+
+    Ответ общий для воркеров и сбрасывается при изменении тегов, так что
+    словарь не расходится с БД и в нее за ним не ходит.
+    """
+    return {tag["slug"]: tag["id"] for tag in tags_response.payload().data}
+
+
+ingredients_response = PrebuiltJSONResponse("ingredients", build_ingredients)
+recipe_fragments = RecipeFragments("recipes")
@@ -1,11 +1,21 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef, Q,
+                              Value, When)
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe
+from api.cache import tag_ids
+from recipes.constants import SEARCH_CONFIG
+from recipes.models import Ingredient, Recipe, TagRecipe
 
 User = get_user_model()
 
 
+def tag_choices():
+    return [(slug, slug) for slug in tag_ids()]
+
+
 class RecipeFilter(filters.FilterSet):
     """Фильтр рецептов."""
 
@@ -14,11 +24,20 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method="filter_is_in_shopping_cart"
     )
-    tags = filters.AllValuesMultipleFilter(field_name="tags__slug")
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method="filter_tags"
+    )
+    search = filters.CharFilter(method="filter_search")
 
     class Meta:
         model = Recipe
-        fields = ["author", "tags", "is_favorited", "is_in_shopping_cart"]
+        fields = [
+            "author",
+            "tags",
+            "is_favorited",
+            "is_in_shopping_cart",
+            "search",
+        ]
 
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
@@ -30,6 +49,55 @@ class RecipeFilter(filters.FilterSet):
             return queryset.filter(cart_users__user=self.request.user)
         return queryset
 
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов через EXISTS по TagRecipe.
+
+        В отличие от JOIN по tags подзапрос не размножает строки рецепта,
+        поэтому DISTINCT не нужен. Слаги переводятся в id по кэшу тегов.
+        """
+        if not value:
+            return queryset
+        ids = tag_ids()
+        return queryset.filter(
+            Exists(
+                TagRecipe.objects.filter(
+                    recipe=OuterRef("pk"),
+                    tag_id__in=[ids[slug] for slug in value if slug in ids],
+                )
+            )
+        )
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию рецепта.
+
+        В PostgreSQL используется индексированный search_vector, который
+        поддерживает триггер; в SQLite (локально) — icontains.
+        """
+        if not value.strip():
+            return queryset
+        if connection.vendor == "postgresql":
+            query = SearchQuery(
+                value, config=SEARCH_CONFIG, search_type="websearch"
+            )
+            return (
+                queryset.filter(search_vector=query)
+                .annotate(rank=SearchRank(F("search_vector"), query))
+                .order_by("-rank", "-pub_date")
+            )
+        return (
+            queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value)
+            )
+            .annotate(
+                rank=Case(
+                    When(name__icontains=value, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+            )
+            .order_by("-rank", "-pub_date")
+        )
+
 
 class IngredientFilter(filters.FilterSet):
     """Фильтр ингредиентов."""
@@ -0,0 +1,435 @@
+import json
+import random
+import statistics
+import subprocess
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from itertools import combinations, islice
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.middleware import QueryRecorder
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
+from users.models import Subscription
+
+User = get_user_model()
+
+SAMPLE_SIZE = 200
+RECIPE_FILTERS = (
+    "author",
+    "tags",
+    "is_favorited",
+    "is_in_shopping_cart",
+    "search",
+)
+PERSONAL_FILTERS = {"is_favorited", "is_in_shopping_cart"}
+
+Call = namedtuple("Call", "method path token")
+
+
+class Dataset:
+    """Выборка id из базы, из которой строятся запросы."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.users = self.pick(User.objects.filter(is_active=True), "pk")
+        self.authors = self.pick(
+            User.objects.filter(recipes_count__gt=0), "pk"
+        )
+        self.recipes = self.pick(Recipe.objects.all(), "pk")
+        self.cart_users = self.pick(ShoppingListItem.objects.all(), "user_id")
+        self.subscribers = self.pick(Subscription.objects.all(), "user_id")
+        self.tags = list(
+            Tag.objects.order_by("slug").values_list("slug", flat=True)
+        )
+        self.words = sorted(
+            {
+                word
+                for name in Recipe.objects.filter(
+                    pk__in=self.recipes
+                ).values_list("name", flat=True)
+                for word in name.split()
+                if len(word) > 3
+            }
+        )
+        self.prefixes = sorted(
+            {
+                name[:3].lower()
+                for name in Ingredient.objects.filter(
+                    pk__in=self.pick(Ingredient.objects.all(), "pk")
+                ).values_list("name", flat=True)
+            }
+        )
+
+        users = {*self.users, *self.cart_users, *self.subscribers}
+        self.tokens = {
+            user_id: Token.objects.get_or_create(user_id=user_id)[0].key
+            for user_id in sorted(users)
+        }
+        self.favorites = set(
+            Favorite.objects.filter(user_id__in=self.users).values_list(
+                "user_id", "recipe_id"
+            )
+        )
+        self.carts = set(
+            ShoppingCart.objects.filter(user_id__in=self.users).values_list(
+                "user_id", "recipe_id"
+            )
+        )
+
+    def pick(self, queryset, field):
+        """До SAMPLE_SIZE id; одна и та же база дает одну выборку."""
+        ids = sorted(
+            queryset.order_by().values_list(field, flat=True).distinct()
+        )
+        return sorted(self.rng.sample(ids, min(SAMPLE_SIZE, len(ids))))
+
+    def counts(self):
+        return {
+            "users": User.objects.count(),
+            "recipes": Recipe.objects.count(),
+            "favorites": Favorite.objects.count(),
+            "carts": ShoppingCart.objects.count(),
+            "subscriptions": Subscription.objects.count(),
+        }
+
+
+def recipe_list(filters):
+    def build(rng, data):
+        personal = bool(PERSONAL_FILTERS & set(filters))
+        while True:
+            params = {}
+            if "author" in filters:
+                params["author"] = rng.choice(data.authors)
+            if "tags" in filters:
+                params["tags"] = rng.sample(data.tags, min(2, len(data.tags)))
+            for name in PERSONAL_FILTERS & set(filters):
+                params[name] = 1
+            if "search" in filters:
+                params["search"] = rng.choice(data.words)
+            user = rng.choice(data.users)
+            token = (
+                data.tokens[user] if personal or rng.random() < 0.5 else None
+            )
+            yield [
+                Call(
+                    "GET",
+                    f"/api/recipes/?{urlencode(params, doseq=True)}",
+                    token,
+                )
+            ]
+
+    return build
+
+
+def recipe_detail(rng, data):
+    while True:
+        user = rng.choice(data.users)
+        token = data.tokens[user] if rng.random() < 0.5 else None
+        yield [Call("GET", f"/api/recipes/{rng.choice(data.recipes)}/", token)]
+
+
+def download_shopping_cart(rng, data):
+    while True:
+        token = data.tokens[rng.choice(data.cart_users)]
+        yield [Call("GET", "/api/recipes/download_shopping_cart/", token)]
+
+
+def ingredient_search(rng, data):
+    while True:
+        query = urlencode({"name": rng.choice(data.prefixes)})
+        yield [Call("GET", f"/api/ingredients/?{query}", None)]
+
+
+def subscriptions(rng, data):
+    while True:
+        token = data.tokens[rng.choice(data.subscribers)]
+        yield [Call("GET", "/api/users/subscriptions/", token)]
+
+
+def feed(rng, data):
+    while True:
+        token = data.tokens[rng.choice(data.subscribers)]
+        yield [Call("GET", "/api/recipes/feed/", token)]
+
+
+def toggle(kind, existing):
+    """Добавление и удаление в паре: после прогона данные прежние.
+
+    Пара (пользователь, рецепт) не повторяется, поэтому потоки не
+    переключают одну и ту же запись одновременно.
+    """
+
+    def build(rng, data):
+        used = set()
+        while len(used) < len(data.users) * len(data.recipes):
+            pair = (rng.choice(data.users), rng.choice(data.recipes))
+            if pair in used:
+                continue
+            used.add(pair)
+            user, recipe = pair
+            path = f"/api/recipes/{recipe}/{kind}/"
+            calls = [
+                Call("POST", path, data.tokens[user]),
+                Call("DELETE", path, data.tokens[user]),
+            ]
+            if pair in getattr(data, existing):
+                calls.reverse()
+            yield calls
+
+    return build
+
+
+def endpoints():
+    result = {}
+    for size in range(len(RECIPE_FILTERS) + 1):
+        for filters in combinations(RECIPE_FILTERS, size):
+            name = "recipes_list"
+            if filters:
+                name += f"[{'+'.join(filters)}]"
+            result[name] = recipe_list(filters)
+    result.update(
+        {
+            "recipe_detail": recipe_detail,
+            "download_shopping_cart": download_shopping_cart,
+            "ingredient_search": ingredient_search,
+            "subscriptions": subscriptions,
+            "feed": feed,
+            "favorite_toggle": toggle("favorite", "favorites"),
+            "shopping_cart_toggle": toggle("shopping_cart", "carts"),
+        }
+    )
+    return result
+
+
+def percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+class Command(BaseCommand):
+    help = "Benchmark hot API endpoints in-process and report latencies"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Сколько измеряемых обращений к каждому эндпоинту.",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=10,
+            help="Сколько обращений сделать до замера (прогрев кэшей).",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Сколько потоков одновременно отправляют запросы.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="Зерно выборки: одинаковое зерно дает одинаковые запросы.",
+        )
+        parser.add_argument(
+            "--only",
+            action="append",
+            help="Шаблон имени эндпоинта (fnmatch), можно несколько.",
+        )
+        parser.add_argument(
+            "--output", help="Записать JSON в файл вместо вывода в консоль."
+        )
+        parser.add_argument(
+            "--baseline",
+            help="JSON прошлого прогона для сравнения задержек.",
+        )
+
+    def handle(self, *args, **options):
+        for name in ("requests", "concurrency"):
+            if options[name] < 1:
+                raise CommandError(f"--{name} должен быть больше нуля.")
+        if options["warmup"] < 0:
+            raise CommandError("--warmup не может быть отрицательным.")
+        if not Recipe.objects.exists():
+            raise CommandError(
+                "В базе нет рецептов: сначала выполните seed_scale."
+            )
+
+        data = Dataset(random.Random(options["seed"]))
+        host = next(
+            (host for host in settings.ALLOWED_HOSTS if host != "*"),
+            "localhost",
+        )
+        report = {
+            "meta": {
+                "commit": self.commit(),
+                "database": connection.vendor,
+                "dataset": data.counts(),
+                "seed": options["seed"],
+                "requests": options["requests"],
+                "concurrency": options["concurrency"],
+                "started_at": timezone.now().isoformat(),
+            },
+            "endpoints": {},
+        }
+
+        for name, build in endpoints().items():
+            if options["only"] and not any(
+                fnmatch(name, pattern) for pattern in options["only"]
+            ):
+                continue
+            units = build(random.Random(f"{options['seed']}:{name}"), data)
+            try:
+                warmup = list(islice(units, options["warmup"]))
+                measured = list(islice(units, options["requests"]))
+            except IndexError:
+                # rng.choice из пустой выборки: в базе нет таких данных.
+                self.stderr.write(f"{name}: нет данных, пропущен.")
+                continue
+            self.run(warmup, options["concurrency"], host)
+            report["endpoints"][name] = self.summary(
+                *self.run(measured, options["concurrency"], host)
+            )
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.print_table(report)
+        else:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+        if options["baseline"]:
+            self.compare(report, options["baseline"])
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def run(self, units, concurrency, host):
+        """Раздает пачки запросов потокам; вернет замеры и общее время."""
+        chunks = [units[index::concurrency] for index in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(
+                pool.map(lambda chunk: self.worker(chunk, host), chunks)
+            )
+        elapsed = time.perf_counter() - started
+        return [row for rows in results for row in rows], elapsed
+
+    @staticmethod
+    def worker(units, host):
+        client = Client(HTTP_HOST=host)
+        rows = []
+        try:
+            for unit in units:
+                for call in unit:
+                    headers = {}
+                    if call.token:
+                        headers["HTTP_AUTHORIZATION"] = f"Token {call.token}"
+                    recorder = QueryRecorder()
+                    started = time.perf_counter()
+                    with connection.execute_wrapper(recorder):
+                        response = client.generic(
+                            call.method, call.path, **headers
+                        )
+                        if response.streaming:
+                            for _ in response.streaming_content:
+                                pass
+                    rows.append(
+                        (
+                            (time.perf_counter() - started) * 1000,
+                            recorder.count,
+                            response.status_code,
+                        )
+                    )
+        finally:
+            connections.close_all()
+        return rows
+
+    @staticmethod
+    def summary(rows, elapsed):
+        latencies = sorted(latency for latency, _, _ in rows)
+        queries = [count for _, count, _ in rows]
+        statuses = Counter(status for _, _, status in rows)
+        return {
+            "requests": len(rows),
+            "errors": sum(
+                count for status, count in statuses.items() if status >= 400
+            ),
+            "statuses": {
+                str(status): count
+                for status, count in sorted(statuses.items())
+            },
+            "throughput_rps": round(len(rows) / elapsed, 1),
+            "mean_ms": round(statistics.fmean(latencies), 2),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "queries_mean": round(statistics.fmean(queries), 2),
+            "queries_max": max(queries),
+        }
+
+    def print_table(self, report):
+        width = max(map(len, report["endpoints"]), default=0)
+        for name, row in report["endpoints"].items():
+            line = (
+                f"{name:<{width}} {row['throughput_rps']:>8} rps  "
+                f"p50 {row['p50_ms']:>7} мс  p99 {row['p99_ms']:>7} мс  "
+                f"SQL {row['queries_mean']:>5}"
+            )
+            if row["errors"]:
+                line += f"  ошибок {row['errors']}"
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+
+    def compare(self, report, path):
+        with open(path, encoding="utf-8") as file:
+            baseline = json.load(file)
+        for key, title in (
+            ("dataset", "Данные"),
+            ("concurrency", "Число потоков"),
+            ("database", "СУБД"),
+        ):
+            if baseline["meta"][key] != report["meta"][key]:
+                self.stdout.write(
+                    self.style.WARNING(f"{title}: не как в базовом прогоне.")
+                )
+        self.stdout.write(f"Сравнение с {baseline['meta']['commit'] or path}:")
+        width = max(map(len, report["endpoints"]), default=0)
+        for name, row in report["endpoints"].items():
+            old = baseline["endpoints"].get(name)
+            if old is None:
+                continue
+            changes = "  ".join(
+                f"{key[:-3]} {old[key]} → {row[key]} мс "
+                f"({(row[key] - old[key]) / old[key]:+.0%})"
+                for key in ("p50_ms", "p99_ms")
+                if old[key]
+            )
+            self.stdout.write(
+                f"{name:<{width}} {changes}  "
+                f"SQL {old['queries_mean']} → {row['queries_mean']}"
+            )
@@ -0,0 +1,116 @@
+"""Учет SQL-запросов каждого HTTP-запроса.
+
+Включается настройкой SQL_INSTRUMENTATION. Для каждого запроса
+считаются число SQL-запросов и время в БД, они отдаются в заголовках
+Server-Timing и X-DB-Queries. Запросы, превысившие SLOW_REQUEST_QUERIES
+или SLOW_REQUEST_MS, пишутся в лог api.sql вместе с самыми частыми
+отпечатками SQL: N+1 выглядит как один отпечаток, повторенный по
+строке на каждый объект страницы.
+
+В отличие от connection.queries работает и при DEBUG=False.
+"""
+import hashlib
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("api.sql")
+
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+)
+TOP_FINGERPRINTS = 5
+
+
+def fingerprint(sql):
+    """SQL без значений: запросы, отличающиеся только ими, совпадают."""
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper, которая копит число и время запросов."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+    def fingerprints(self):
+        counter = Counter()
+        for sql, count in self.statements.items():
+            counter[fingerprint(sql)] += count
+        return counter.most_common(TOP_FINGERPRINTS)
+
+
+class SQLInstrumentationMiddleware:
+    """Заголовки с числом и временем SQL-запросов и лог медленных."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        total = (time.perf_counter() - start) * 1000
+        db = recorder.duration * 1000
+
+        response["X-DB-Queries"] = str(recorder.count)
+        response["Server-Timing"] = (
+            f'db;dur={db:.1f};desc="{recorder.count} queries", '
+            f"total;dur={total:.1f}"
+        )
+        if (
+            recorder.count > settings.SLOW_REQUEST_QUERIES
+            or total > settings.SLOW_REQUEST_MS
+        ):
+            self.log(request, response, recorder, total, db)
+        return response
+
+    @staticmethod
+    def view_name(request):
+        match = request.resolver_match
+        if match is None:
+            return request.path
+        return match.view_name or match._func_path
+
+    def log(self, request, response, recorder, total, db):
+        lines = [
+            f"{count} x [{hashlib.md5(sql.encode()).hexdigest()[:8]}] {sql}"
+            for sql, count in recorder.fingerprints()
+        ]
+        logger.warning(
+            "Медленный запрос %s %s (%s): %s, %d SQL за %.1f мс из %.1f мс"
+            "\n%s",
+            request.method,
+            request.get_full_path(),
+            self.view_name(request),
+            response.status_code,
+            recorder.count,
+            db,
+            total,
+            "\n".join(lines),
+        )
@@ -1,12 +1,210 @@
+import base64
+import binascii
+import heapq
+import json
+from collections import OrderedDict
+from functools import reduce
+from itertools import islice
+from operator import itemgetter, or_
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class FoodgramPagination(PageNumberPagination):
-    """Пагинация через ?limit={число}."""
+    """Пагинация через ?limit={число}.
+
+    Вьюсеты с атрибутом cursor_ordering дополнительно поддерживают
+    пагинацию по курсору: ?cursor= (пустой — первая страница) включает
+    выборку по ключу сортировки вместо OFFSET и без COUNT(*), а в ответе
+    вместо count и номеров страниц приходят ссылки next/previous.
+    """
+
+    max_page_size = settings.MAX_PAGE_SIZE
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Неверный курсор."
 
     def get_page_size(self, request):
         limit = request.query_params.get("limit", self.page_size)
         try:
-            return int(limit)
+            limit = int(limit)
         except ValueError:
             return self.page_size
+        if limit < 1:
+            return self.page_size
+        return min(limit, self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, "cursor_ordering", None)
+        if (
+            self.ordering is None
+            or self.cursor_query_param not in request.query_params
+        ):
+            self.ordering = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.model = queryset.model
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self.flip(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(ordering, position))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.position(results[-1])
+            if position is not None and (has_more or not reverse):
+                self.previous_position = self.position(results[0])
+        return results
+
+    def paginate_merged(self, sources, request):
+        """Страница по курсору из нескольких выборок сразу.
+
+        sources — пары (queryset, ordering) с одинаковым направлением
+        сортировки; поля могут называться по-разному, позиция курсора
+        хранится по порядку полей. Из каждой выборки читается не больше
+        страницы после позиции, результаты сливаются, как UNION ALL с
+        ORDER BY и LIMIT. Курсор разбирается по полям первой выборки.
+        """
+        self.request = request
+        first, self.ordering = sources[0]
+        self.model = first.model
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        values = None if position is None else list(position.values())
+
+        rows = []
+        for queryset, ordering in sources:
+            if reverse:
+                ordering = tuple(self.flip(field) for field in ordering)
+            names = [field.lstrip("-") for field in ordering]
+            queryset = queryset.order_by(*ordering)
+            if values is not None:
+                queryset = queryset.filter(
+                    self.after(ordering, dict(zip(names, values)))
+                )
+            rows.append(
+                [
+                    (tuple(getattr(item, name) for name in names), item)
+                    for item in queryset[:page_size + 1]
+                ]
+            )
+        descending = ordering[0].startswith("-")
+        merged = list(
+            islice(
+                heapq.merge(*rows, key=itemgetter(0), reverse=descending),
+                page_size + 1,
+            )
+        )
+        has_more = len(merged) > page_size
+        merged = merged[:page_size]
+        if reverse:
+            merged.reverse()
+
+        names = [field.lstrip("-") for field in self.ordering]
+        self.next_position = self.previous_position = None
+        if merged:
+            if has_more or reverse:
+                self.next_position = dict(zip(names, merged[-1][0]))
+            if position is not None and (has_more or not reverse):
+                self.previous_position = dict(zip(names, merged[0][0]))
+        return [item for _, item in merged]
+
+    def get_paginated_response(self, data):
+        if self.ordering is None:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.cursor_link(self.next_position, False)),
+                    (
+                        "previous",
+                        self.cursor_link(self.previous_position, True),
+                    ),
+                    ("results", data),
+                ]
+            )
+        )
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def after(ordering, position):
+        """Условие «строго после позиции» для составного ключа."""
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal = {
+                previous.lstrip("-"): position[previous.lstrip("-")]
+                for previous in ordering[:index]
+            }
+            conditions.append(
+                Q(**equal, **{f"{name}__{lookup}": position[name]})
+            )
+        return reduce(or_, conditions)
+
+    def position(self, instance):
+        return {
+            field.lstrip("-"): getattr(instance, field.lstrip("-"))
+            for field in self.ordering
+        }
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            reverse = bool(cursor["r"])
+            values = cursor["p"]
+            names = [field.lstrip("-") for field in self.ordering]
+            if not isinstance(values, list) or len(values) != len(names):
+                raise ValueError
+            position = {
+                name: self.model._meta.get_field(name).to_python(value)
+                for name, value in zip(names, values)
+            }
+        except (
+            binascii.Error,
+            KeyError,
+            TypeError,
+            ValueError,
+            ValidationError,
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def cursor_link(self, position, reverse):
+        if position is None:
+            return None
+        values = [
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in position.values()
+        ]
+        encoded = base64.urlsafe_b64encode(
+            json.dumps({"p": values, "r": int(reverse)}).encode()
+        ).decode()
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, encoded)
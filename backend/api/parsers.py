@@ -0,0 +1,35 @@
+import json
+
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """multipart/form-data, где вложенные поля переданы строками JSON.
+
+    Файлы идут отдельными частями формы и по частям пишутся во временный
+    файл, а поля из multipart_json_fields вьюсета разбираются как JSON,
+    чтобы сериализатор получил те же данные, что и из JSON-запроса.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        view = (parser_context or {}).get("view")
+        json_fields = getattr(view, "multipart_json_fields", ())
+        if not json_fields:
+            return parsed
+
+        data = {}
+        for key, values in parsed.data.lists():
+            value = values[-1]
+            if key in json_fields:
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    raise ParseError(f"Поле {key} должно быть строкой JSON.")
+            data[key] = value
+        # Файлы кладутся в сами данные: Request.data объединяет data и
+        # files через dict.update, а он берет из MultiValueDict списки.
+        data.update(parsed.files.dict())
+        return DataAndFiles(data, MultiValueDict())
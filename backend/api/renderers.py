@@ -1,4 +1,14 @@
-from rest_framework.renderers import BaseRenderer
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
 
 
 class PlainTextRenderer(BaseRenderer):
@@ -14,3 +24,61 @@ class PlainTextRenderer(BaseRenderer):
         elif isinstance(data, list):
             data = "\n".join(data)
         return data.encode(self.charset)
+
+    def stream(self, rows):
+        """Построчно отдает список покупок."""
+        for row in rows:
+            yield (
+                f"{row['name']} - {row['total_amount']}"
+                f"({row['measurement_unit']})\n"
+            ).encode(self.charset)
+
+
+class CSVRenderer(BaseRenderer):
+    """Конвертирует данные в csv format."""
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+    header = ("name", "measurement_unit", "amount")
+
+    def render(self, data, media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = [data]
+        writer = csv.writer(Echo())
+        return "".join(writer.writerow(row.values()) for row in data).encode(
+            self.charset
+        )
+
+    def stream(self, rows):
+        """Построчно отдает список покупок."""
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header).encode(self.charset)
+        for row in rows:
+            yield writer.writerow(
+                (row["name"], row["measurement_unit"], row["total_amount"])
+            ).encode(self.charset)
+
+
+class ShoppingListJSONRenderer(JSONRenderer):
+    """JSON-рендерер с потоковой выдачей списка покупок."""
+
+    charset = "utf-8"
+
+    def stream(self, rows):
+        """Отдает список покупок как JSON-массив по одному элементу."""
+        separator = "["
+        for row in rows:
+            yield (
+                separator
+                + json.dumps(
+                    {
+                        "name": row["name"],
+                        "measurement_unit": row["measurement_unit"],
+                        "amount": row["total_amount"],
+                    },
+                    ensure_ascii=False,
+                )
+            ).encode(self.charset)
+            separator = ","
+        yield ("[]" if separator == "[" else "]").encode(self.charset)
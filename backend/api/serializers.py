@@ -3,42 +3,128 @@ import base64
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
-from django.db.models import Count, Exists
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.template.defaultfilters import filesizeformat
 from djoser.serializers import TokenCreateSerializer, UserSerializer
+from PIL import Image
 from rest_framework import serializers
 
+from jobs.models import Job
+from recipes.images import variants_representation
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag)
 from users.models import Subscription
 
 User = get_user_model()
 
 
 def add_tags_and_ingredients(recipe, ingredients_data, tags_data):
-    """Работает с тегами и ингредиентами при create/update рецепта."""
-    recipe.tags.set(tags_data)
+    """Работает с тегами и ингредиентами при create/update рецепта.
 
-    for ingredient in ingredients_data:
-        current_ingredient = ingredient["id"]
+    Ингредиенты сравниваются с уже сохраненными: лишние удаляются,
+    новые добавляются, у оставшихся обновляется количество — по одному
+    запросу на каждое действие.
+    """
+    recipe.tags.set(tags_data)
 
-        IngredientRecipe.objects.update_or_create(
-            recipe=recipe,
-            ingredient=current_ingredient,
-            amount=ingredient["amount"],
+    existing = {
+        item.ingredient_id: item
+        for item in IngredientRecipe.objects.filter(recipe=recipe)
+    }
+    before = {
+        ingredient_id: item.amount for ingredient_id, item in existing.items()
+    }
+    after = {
+        ingredient["id"].id: ingredient["amount"]
+        for ingredient in ingredients_data
+    }
+
+    removed = [
+        item.id
+        for ingredient_id, item in existing.items()
+        if ingredient_id not in after
+    ]
+    added = [
+        IngredientRecipe(
+            recipe=recipe, ingredient_id=ingredient_id, amount=amount
         )
+        for ingredient_id, amount in after.items()
+        if ingredient_id not in existing
+    ]
+    changed = []
+    for ingredient_id, amount in after.items():
+        item = existing.get(ingredient_id)
+        if item is not None and item.amount != amount:
+            item.amount = amount
+            changed.append(item)
+
+    if removed:
+        IngredientRecipe.objects.filter(id__in=removed).delete()
+    if added:
+        IngredientRecipe.objects.bulk_create(added)
+    if changed:
+        IngredientRecipe.objects.bulk_update(changed, ["amount"])
+
+    ShoppingListItem.objects.apply_recipe_change(recipe.id, before, after)
+
+
+def get_recipes_limit(context):
+    """Значение ?recipes_limit= или None, если оно не задано."""
+    request = context.get("request")
+    if request is None:
+        return None
+    try:
+        return max(int(request.query_params["recipes_limit"]), 0)
+    except (KeyError, ValueError):
+        return None
 
 
 class Base64ImageField(serializers.ImageField):
-    """Декодирует изображение из base64."""
+    """Изображение строкой base64 или файлом из multipart/form-data.
+
+    Размер и число пикселей проверяются до декодирования: base64 — по
+    длине строки, файл — по размеру и заголовку изображения, который
+    Pillow читает без распаковки пикселей.
+    """
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
             format, imgstr = data.split(";base64,")
+            self.check_size(len(imgstr) * 3 // 4)
             ext = format.split("/")[-1]
             data = ContentFile(base64.b64decode(imgstr), name="temp." + ext)
 
+        if hasattr(data, "size"):
+            self.check_size(data.size)
+            self.check_dimensions(data)
         return super().to_internal_value(data)
 
+    @staticmethod
+    def check_size(size):
+        if size > settings.MAX_IMAGE_SIZE:
+            raise serializers.ValidationError(
+                "Размер изображения больше "
+                f"{filesizeformat(settings.MAX_IMAGE_SIZE)}."
+            )
+
+    @staticmethod
+    def check_dimensions(file):
+        try:
+            width, height = Image.open(file).size
+        except Image.DecompressionBombError:
+            width = height = settings.MAX_IMAGE_PIXELS
+        except OSError:
+            # Не изображение: ошибку сообщит проверка ImageField.
+            return
+        finally:
+            file.seek(0)
+        if width * height > settings.MAX_IMAGE_PIXELS:
+            raise serializers.ValidationError(
+                "Изображение слишком большое: допустимо до "
+                f"{settings.MAX_IMAGE_PIXELS} пикселей."
+            )
+
 
 class TokenLoginSerializer(TokenCreateSerializer):
     """Сериализатор для входа и получения токена."""
@@ -69,6 +155,8 @@ class NewUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(
@@ -81,6 +169,9 @@ class NewUserSerializer(UserSerializer):
         if instance.avatar:
             avatar_url = instance.avatar.url
             representation["avatar"] = f"{settings.BASE_URL}{avatar_url}"
+        representation["avatar_variants"] = variants_representation(
+            instance.avatar, instance.avatar_placeholder
+        )
         return representation
 
 
@@ -157,17 +248,39 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         if instance.image:
             image_url = instance.image.url
             representation["image"] = f"{settings.BASE_URL}{image_url}"
+        representation["image_variants"] = variants_representation(
+            instance.image, instance.image_placeholder
+        )
         return representation
 
 
+class IngredientRecipeListSerializer(serializers.ListSerializer):
+    """Загружает все ингредиенты рецепта одним запросом."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            {item["id"] for item in items}
+        )
+        for item in items:
+            if item["id"] not in ingredients:
+                raise serializers.ValidationError(
+                    f'Недопустимый первичный ключ "{item["id"]}" - '
+                    "объект не существует."
+                )
+            item["id"] = ingredients[item["id"]]
+        return items
+
+
 class IngredientRecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для записи игредиентов в рецепте."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientRecipe
         fields = ("id", "amount")
+        list_serializer_class = IngredientRecipeListSerializer
 
 
 class RecipeIWriteSerializer(serializers.ModelSerializer):
@@ -262,6 +375,7 @@ class RecipeIWriteSerializer(serializers.ModelSerializer):
 
         return attrs
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop("ingredients")
         tags_data = validated_data.pop("tags")
@@ -272,6 +386,7 @@ class RecipeIWriteSerializer(serializers.ModelSerializer):
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if "image" in validated_data:
             instance.image = validated_data.pop("image")
@@ -284,6 +399,14 @@ class RecipeIWriteSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         """Метод для возвращения данных, как при GET запросе."""
+        prefetch_related_objects(
+            [instance],
+            "tags",
+            Prefetch(
+                "recipe_ingredients",
+                queryset=IngredientRecipe.objects.select_related("ingredient"),
+            ),
+        )
         serializer = RecipeReadSerializer(instance)
         return serializer.data
 
@@ -300,6 +423,9 @@ class RecipeRepresentation(serializers.ModelSerializer):
         if instance.image:
             image_url = instance.image.url
             representation["image"] = f"{settings.BASE_URL}{image_url}"
+        representation["image_variants"] = variants_representation(
+            instance.image, instance.image_placeholder
+        )
         return representation
 
 
@@ -351,11 +477,25 @@ class FavoriteSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
+class SubscriptionListSerializer(serializers.ListSerializer):
+    """Загружает рецепты всех авторов страницы одним запросом."""
+
+    def to_representation(self, data):
+        authors = list(data)
+        recipes = Recipe.objects.latest_by_author(
+            [author.id for author in authors],
+            get_recipes_limit(self.context),
+        )
+        for author in authors:
+            author.latest_recipes = recipes.get(author.id, [])
+        return super().to_representation(authors)
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения подписок."""
 
     is_subscribed = serializers.BooleanField()
-    recipes = RecipeRepresentation(many=True)
+    recipes = RecipeRepresentation(many=True, source="latest_recipes")
     recipes_count = serializers.IntegerField()
 
     class Meta:
@@ -371,12 +511,20 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             "recipes_count",
             "avatar",
         )
+        list_serializer_class = SubscriptionListSerializer
 
     def to_representation(self, instance):
+        if not hasattr(instance, "latest_recipes"):
+            instance.latest_recipes = Recipe.objects.latest_by_author(
+                [instance.id], get_recipes_limit(self.context)
+            ).get(instance.id, [])
         representation = super().to_representation(instance)
         if instance.avatar:
             avatar_url = instance.avatar.url
             representation["avatar"] = f"{settings.BASE_URL}{avatar_url}"
+        representation["avatar_variants"] = variants_representation(
+            instance.avatar, instance.avatar_placeholder
+        )
         return representation
 
 
@@ -399,16 +547,12 @@ class SubscribeActionSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         subscribed_to = instance.subscribed_to
-        context = {"current_user": instance.user}
-        user_with_count = User.objects.annotate(
-            recipes_count=Count("recipes"),
-            is_subscribed=Exists(
-                Subscription.objects.filter(
-                    user=context["current_user"], subscribed_to=subscribed_to
-                )
-            ),
-        ).get(id=subscribed_to.id)
-        serializer = SubscriptionSerializer(user_with_count, context=context)
+        subscribed_to.is_subscribed = True
+        context = {
+            "current_user": instance.user,
+            "request": self.context.get("request"),
+        }
+        serializer = SubscriptionSerializer(subscribed_to, context=context)
         return serializer.data
 
 
@@ -431,7 +575,18 @@ class AvatarSerializer(serializers.ModelSerializer):
             )
         return attrs
 
-    def update(self, instance, validated_data):
-        if "avatar" in validated_data and instance.avatar:
-            instance.avatar.delete(save=False)
-        return super().update(instance, validated_data)
+
+class JobSerializer(serializers.ModelSerializer):
+    """Состояние фоновой задачи пользователя."""
+
+    class Meta:
+        model = Job
+        fields = (
+            "id",
+            "name",
+            "status",
+            "attempts",
+            "result",
+            "created_at",
+            "finished_at",
+        )
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from api.cache import ingredients_response, tags_response
+from recipes.models import Ingredient, Tag
+from recipes.signals import ingredients_imported
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags_response(sender, **kwargs):
+    """Сбрасывает готовый ответ со списком тегов после коммита."""
+    transaction.on_commit(tags_response.invalidate)
+
+
+@receiver(ingredients_imported)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredients_response(sender, **kwargs):
+    """Сбрасывает готовый ответ со списком ингредиентов после коммита."""
+    transaction.on_commit(ingredients_response.invalidate)
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    """Выход в djoser удаляет токен: его запись в кэше отзывается."""
+    transaction.on_commit(token_cache.revoke)
+
+
+@receiver(post_save, sender=User)
+def revoke_changed_user(sender, instance, created, update_fields, **kwargs):
+    """Смена пароля, деактивация и правка профиля сбрасывают кэш токенов.
+
+    Изменения через QuerySet.update() сигнала не шлют; такие поля
+    (счетчики, отметки) в кэше могут устареть на
+    AUTH_TOKEN_CACHE_TIMEOUT.
+    """
+    if created or update_fields == frozenset(["last_login"]):
+        return
+    transaction.on_commit(token_cache.revoke)
@@ -0,0 +1,41 @@
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from api.renderers import (CSVRenderer, PlainTextRenderer,
+                           ShoppingListJSONRenderer)
+from jobs.models import Job
+from jobs.registry import task
+from recipes.models import ShoppingListItem
+
+RENDERERS = {
+    renderer.format: renderer
+    for renderer in (PlainTextRenderer, CSVRenderer, ShoppingListJSONRenderer)
+}
+
+
+@task("shopping_list.render")
+def render_shopping_list(user_id, format):
+    """Сохраняет список покупок в файл и возвращает ссылку на него.
+
+    Случайный каталог в пути не дает угадать ссылку на чужой список.
+    Через SHOPPING_LIST_FILE_TTL секунд файл удаляет отложенная задача.
+    """
+    renderer = RENDERERS[format]()
+    rows = ShoppingListItem.objects.for_download(user_id)
+    name = default_storage.save(
+        f"shopping_lists/{user_id}/{secrets.token_urlsafe(16)}/"
+        f"products_list.{format}",
+        ContentFile(b"".join(renderer.stream(rows))),
+    )
+    Job.objects.enqueue(
+        "images.delete_files",
+        run_at=timezone.now()
+        + timedelta(seconds=settings.SHOPPING_LIST_FILE_TTL),
+        names=[name],
+    )
+    return {"url": f"{settings.BASE_URL}{default_storage.url(name)}"}
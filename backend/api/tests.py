@@ -0,0 +1,1045 @@
+"""Бюджеты SQL-запросов для маршрутов api/urls.py.
+
+Каждый маршрут вызывается анонимно и с токеном, списки — при двух
+размерах страницы. Тест падает, если запросов стало больше бюджета или
+если их число растет вместе с числом строк на странице: так выглядит
+N+1 в новом SerializerMethodField или to_representation.
+
+Перед каждым запросом сбрасываются кэши (фрагменты рецептов, готовые
+ответы справочников), поэтому считается холодный путь, который кэш не
+скрывает, и кэш токенов: запрос токена входит в бюджет.
+"""
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from itertools import islice
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.conf import global_settings, settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import middleware
+from api.authentication import token_cache
+from api.cache import (PrebuiltJSONResponse, build_ingredients, build_tags,
+                       ingredients_response, tags_response)
+from api.views import RecipeViewSet
+from jobs.models import Job
+from recipes.generations import check_generations_cache
+from recipes.images import stored_names
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag, TimelineEntry)
+from recipes.search import IngredientIndex, ingredient_index
+from recipes.tasks import fan_out, refill
+from users.models import Subscription
+
+User = get_user_model()
+
+TEMP_DIR = tempfile.mkdtemp(prefix="foodgram-tests-")
+PAGE_SIZES = (2, 6)
+AUTHORS = 8
+RECIPES_PER_AUTHOR = 6
+
+# Маршрут, бюджет анонима (None — нужен токен), бюджет с токеном,
+# список ли это (тогда проверяются оба размера страницы).
+READ_BUDGETS = (
+    ("/api/tags/", 1, 1, False),
+    ("/api/tags/{tag}/", 1, 1, False),
+    ("/api/ingredients/", 1, 1, False),
+    ("/api/ingredients/?name=Ингредиент", 1, 1, False),
+    ("/api/ingredients/{ingredient}/", 1, 1, False),
+    ("/api/recipes/", 6, 8, True),
+    ("/api/recipes/?cursor=", 5, 7, True),
+    ("/api/recipes/?tags=breakfast&tags=dinner", 7, 9, True),
+    ("/api/recipes/?author={author}", 7, 9, True),
+    ("/api/recipes/?is_favorited=1", 6, 8, True),
+    ("/api/recipes/?is_in_shopping_cart=1", 6, 8, True),
+    ("/api/recipes/{recipe}/", 5, 6, False),
+    ("/api/recipes/{recipe}/get-link/", 4, 5, False),
+    ("/api/recipes/download_shopping_cart/", None, 2, False),
+    ("/api/recipes/feed/", None, 8, True),
+    ("/api/users/", 2, 3, True),
+    ("/api/users/{author}/", 1, 2, False),
+    ("/api/users/me/", None, 2, False),
+    ("/api/users/subscriptions/", None, 4, True),
+    ("/api/users/subscriptions/?recipes_limit=1", None, 4, True),
+    ("/api/jobs/", None, 3, True),
+    ("/api/jobs/{job}/", None, 2, False),
+)
+
+
+def tearDownModule():
+    shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+
+def image_data():
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), (200, 120, 40)).save(buffer, format="PNG")
+    return (
+        "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+def invalidate_in_subprocess(target, method="invalidate"):
+    """Сбрасывает target так, будто это сделал другой процесс."""
+    module, name = target.rsplit(".", 1)
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import django; django.setup(); "
+            f"from {module} import {name}; {name}.{method}()",
+        ],
+        check=True,
+        cwd=settings.BASE_DIR,
+        env={**os.environ, "GENERATIONS_DIR": settings.GENERATIONS_DIR},
+    )
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_DIR,
+    PREBUILT_RESPONSES_DIR=TEMP_DIR,
+)
+class QueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(
+            username="viewer",
+            email="viewer@example.com",
+            password="Viewer-password-1",
+            first_name="Зритель",
+            last_name="Тестов",
+        )
+        cls.token = Token.objects.create(user=cls.viewer).key
+        cls.tags = [
+            Tag.objects.create(name=name, slug=slug)
+            for name, slug in (
+                ("Завтрак", "breakfast"),
+                ("Обед", "lunch"),
+                ("Ужин", "dinner"),
+            )
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f"Ингредиент {index}", measurement_unit="г"
+            )
+            for index in range(10)
+        ]
+        cls.authors = []
+        cls.recipes = []
+        for index in range(AUTHORS):
+            author = User.objects.create_user(
+                username=f"author{index}",
+                email=f"author{index}@example.com",
+                password="Author-password-1",
+                first_name="Автор",
+                last_name=str(index),
+            )
+            cls.authors.append(author)
+            for number in range(RECIPES_PER_AUTHOR):
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name=f"Рецепт {index}-{number}",
+                    text="Описание",
+                    image="recipes/images/test.jpg",
+                    cooking_time=10,
+                )
+                recipe.tags.set(
+                    tag for tag in cls.tags if tag.pk % 3 != number % 3
+                )
+                IngredientRecipe.objects.bulk_create(
+                    IngredientRecipe(
+                        recipe=recipe, ingredient=ingredient, amount=100
+                    )
+                    for ingredient in islice(cls.ingredients, number, None, 2)
+                )
+                cls.recipes.append(recipe)
+            Subscription.objects.create(user=cls.viewer, subscribed_to=author)
+        for recipe in cls.recipes[::2]:
+            Favorite.objects.create(user=cls.viewer, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+        cls.jobs = [
+            Job.objects.create(name="shopping_list.render", user=cls.viewer)
+            for _ in range(AUTHORS)
+        ]
+
+    def client_for(self, token=None):
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        return client
+
+    def request(self, method, url, token=None, data=None):
+        """Один вызов с холодными кэшами и перехватом запросов к БД."""
+        caches["recipes"].clear()
+        token_cache.revoke()
+        tags_response.invalidate()
+        ingredients_response.invalidate()
+        client = self.client_for(token)
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(client, method)(url, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(
+            response.status_code,
+            400,
+            f"{method.upper()} {url}: {response.status_code}",
+        )
+        return context, response
+
+    def check(self, method, url, token, budget, data=None):
+        """Проверяет, что запрос укладывается в бюджет budget."""
+        context, response = self.request(method, url, token, data)
+        self.assertLessEqual(
+            len(context),
+            budget,
+            f"{method.upper()} {url}: запросов больше бюджета {budget}:\n"
+            + "\n".join(query["sql"] for query in context),
+        )
+        return len(context), response
+
+    def route(self, template):
+        return template.format(
+            tag=self.tags[0].pk,
+            ingredient=self.ingredients[0].pk,
+            recipe=self.recipes[0].pk,
+            author=self.authors[0].pk,
+            job=self.jobs[0].pk,
+        )
+
+    def test_read_routes(self):
+        for template, anonymous, authorized, paginated in READ_BUDGETS:
+            url = self.route(template)
+            for token, budget in ((None, anonymous), (self.token, authorized)):
+                if budget is None:
+                    continue
+                who = "с токеном" if token else "аноним"
+                with self.subTest(url=url, who=who):
+                    if not paginated:
+                        self.check("get", url, token, budget)
+                        continue
+                    counts = []
+                    for size in PAGE_SIZES:
+                        separator = "&" if "?" in url else "?"
+                        count, response = self.check(
+                            "get",
+                            f"{url}{separator}{urlencode({'limit': size})}",
+                            token,
+                            budget,
+                        )
+                        self.assertEqual(
+                            len(response.data["results"]),
+                            size,
+                            "На странице должно хватать строк для сравнения.",
+                        )
+                        counts.append(count)
+                    self.assertEqual(
+                        counts[0],
+                        counts[-1],
+                        f"Число запросов растет с размером страницы: "
+                        f"{dict(zip(PAGE_SIZES, counts))}.",
+                    )
+
+    def test_list_etag(self):
+        url = "/api/recipes/?limit=2"
+        client = self.client_for(self.token)
+        etag = client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Только отметка пользователя: токен уже в кэше, а рецепты для
+        # версии не выбираются.
+        self.assertEqual(len(context), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipes[-1].delete()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertFalse(response.has_header("Last-Modified"))
+
+    def test_tag_filter_is_or_without_duplicates(self):
+        response = self.client_for().get(
+            "/api/recipes/?tags=breakfast&tags=dinner&limit=100"
+        )
+        ids = [recipe["id"] for recipe in response.data["results"]]
+        expected = set(
+            Recipe.objects.filter(
+                tags__slug__in=["breakfast", "dinner"]
+            ).values_list("id", flat=True)
+        )
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), expected)
+        self.assertEqual(response.data["count"], len(expected))
+        response = self.client_for().get("/api/recipes/?tags=unknown")
+        self.assertEqual(response.status_code, 400)
+
+    def feed_ids(self, url):
+        """id рецептов по всем страницам ленты, начиная с url."""
+        client = self.client_for(self.token)
+        ids = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe["id"] for recipe in response.data["results"])
+            url = response.data["next"]
+        return ids
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_feed_merges_timeline_and_celebrities(self):
+        celebrity, author = self.authors[0], self.authors[1]
+        Subscription.objects.create(
+            user=self.authors[2], subscribed_to=celebrity
+        )
+        for recipe_author in (celebrity, author):
+            recipe = Recipe.objects.create(
+                author=recipe_author,
+                name="Свежий рецепт",
+                text="Описание",
+                image="recipes/images/test.jpg",
+                cooking_time=5,
+            )
+            fan_out(recipe.pk)
+        self.assertFalse(
+            TimelineEntry.objects.filter(
+                recipe__author=celebrity, recipe__name="Свежий рецепт"
+            ).exists()
+        )
+        expected = list(
+            Recipe.objects.filter(author__in=self.authors)
+            .order_by("-pub_date", "-id")
+            .values_list("id", flat=True)
+        )
+        self.assertEqual(self.feed_ids("/api/recipes/feed/?limit=5"), expected)
+
+        client = self.client_for(self.token)
+        second = client.get(
+            client.get("/api/recipes/feed/?limit=5").data["next"]
+        )
+        first = client.get(second.data["previous"])
+        self.assertEqual(
+            [recipe["id"] for recipe in first.data["results"]], expected[:5]
+        )
+
+        client.delete(f"/api/users/{author.pk}/subscribe/")
+        self.assertFalse(
+            Recipe.objects.filter(
+                pk__in=self.feed_ids("/api/recipes/feed/"), author=author
+            ).exists()
+        )
+        client.post(f"/api/users/{author.pk}/subscribe/")
+        self.assertEqual(self.feed_ids("/api/recipes/feed/"), expected)
+
+    @override_settings(FEED_CELEBRITY_THRESHOLD=2)
+    def test_feed_refills_author_below_threshold(self):
+        celebrity = self.authors[0]
+        follower = Subscription.objects.create(
+            user=self.authors[2], subscribed_to=celebrity
+        )
+        recipe = Recipe.objects.create(
+            author=celebrity,
+            name="Свежий рецепт",
+            text="Описание",
+            image="recipes/images/test.jpg",
+            cooking_time=5,
+        )
+        fan_out(recipe.pk)
+        follower.delete()
+        job = Job.objects.get(name="feed.refill")
+        self.assertEqual(job.payload, {"author_id": celebrity.pk})
+        refill(**job.payload)
+        self.assertIn(recipe.pk, self.feed_ids("/api/recipes/feed/"))
+
+    def test_deliver_skips_unsubscribed_users(self):
+        recipe = self.recipes[0]
+        delivered = TimelineEntry.objects.deliver(
+            recipe, [self.viewer.pk, self.authors[2].pk], 10
+        )
+        self.assertEqual(delivered, 0)
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.authors[2]).exists()
+        )
+        TimelineEntry.objects.filter(user=self.viewer).delete()
+        self.assertEqual(
+            TimelineEntry.objects.deliver(
+                recipe, [self.viewer.pk, self.authors[2].pk], 10
+            ),
+            1,
+        )
+        self.assertEqual(
+            list(TimelineEntry.objects.values_list("user_id", "author_id")),
+            [(self.viewer.pk, recipe.author_id)],
+        )
+
+    def test_search_keeps_rank_order_with_cursor(self):
+        by_name, by_text = (
+            Recipe.objects.create(
+                author=self.authors[0],
+                name=name,
+                text=text,
+                image="recipes/images/test.jpg",
+                cooking_time=5,
+            )
+            for name, text in (
+                ("Суп щавелевый", "Описание"),
+                ("Зеленый суп", "Густой щавелевый отвар"),
+            )
+        )
+        response = self.client_for().get(
+            "/api/recipes/?search=щавелевый&cursor="
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"]],
+            [by_name.pk, by_text.pk],
+        )
+
+    def test_anonymous_is_rejected_cheaply(self):
+        for template, anonymous, _, _ in READ_BUDGETS:
+            if anonymous is not None:
+                continue
+            url = self.route(template)
+            with self.subTest(url=url):
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client_for().get(url)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(len(context), 0)
+
+    def test_favorite_and_cart_toggles(self):
+        recipe = self.recipes[1]
+        for kind, budget in (("favorite", 9), ("shopping_cart", 14)):
+            url = f"/api/recipes/{recipe.pk}/{kind}/"
+            for method in ("post", "delete"):
+                with self.subTest(url=url, method=method):
+                    self.check(method, url, self.token, budget)
+
+    def test_subscribe_toggle(self):
+        author = User.objects.create_user(
+            username="newauthor",
+            email="newauthor@example.com",
+            password="Author-password-1",
+        )
+        url = f"/api/users/{author.pk}/subscribe/"
+        for method, budget in (("post", 11), ("delete", 7)):
+            with self.subTest(method=method):
+                self.check(method, url, self.token, budget)
+
+    def recipe_payload(self, ingredients):
+        return {
+            "name": "Новый рецепт",
+            "text": "Описание",
+            "cooking_time": 15,
+            "image": image_data(),
+            "tags": [tag.pk for tag in self.tags],
+            "ingredients": [
+                {"id": ingredient.pk, "amount": 10}
+                for ingredient in self.ingredients[:ingredients]
+            ],
+        }
+
+    def test_recipe_create_does_not_grow_with_ingredients(self):
+        counts = []
+        for size in (2, 6):
+            with self.subTest(ingredients=size):
+                count, _ = self.check(
+                    "post",
+                    "/api/recipes/",
+                    self.token,
+                    20,
+                    self.recipe_payload(size),
+                )
+                counts.append(count)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_recipe_update_and_delete(self):
+        recipe = Recipe.objects.create(
+            author=self.viewer,
+            name="Свой рецепт",
+            text="Описание",
+            image="recipes/images/test.jpg",
+            cooking_time=5,
+        )
+        url = f"/api/recipes/{recipe.pk}/"
+        payload = self.recipe_payload(4)
+        del payload["image"]
+        self.check("patch", url, self.token, 21, payload)
+        self.check("delete", url, self.token, 13)
+
+    def test_avatar(self):
+        url = "/api/users/me/avatar/"
+        self.check("put", url, self.token, 6, {"avatar": image_data()})
+        self.check("delete", url, self.token, 4)
+
+    def test_signup_and_tokens(self):
+        self.check(
+            "post",
+            "/api/users/",
+            None,
+            3,
+            {
+                "email": "new@example.com",
+                "username": "newcomer",
+                "first_name": "Новый",
+                "last_name": "Пользователь",
+                "password": "Newcomer-password-1",
+            },
+        )
+        _, response = self.check(
+            "post",
+            "/api/auth/token/login/",
+            None,
+            6,
+            {"email": "new@example.com", "password": "Newcomer-password-1"},
+        )
+        token = response.data["auth_token"]
+        self.check(
+            "post",
+            "/api/users/set_password/",
+            token,
+            3,
+            {
+                "current_password": "Newcomer-password-1",
+                "new_password": "Newcomer-password-2",
+            },
+        )
+        self.check("post", "/api/auth/token/logout/", token, 3)
+
+
+class TokenCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f"user{index}",
+                email=f"user{index}@example.com",
+                password="User-password-1",
+            )
+            for index in range(2)
+        ]
+        cls.tokens = [
+            Token.objects.create(user=user).key for user in cls.users
+        ]
+
+    def setUp(self):
+        token_cache.revoke()
+
+    def get_me(self, token):
+        """GET /api/users/me/; вернет ответ и был ли запрос токена в БД."""
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        with CaptureQueriesContext(connection) as context:
+            response = client.get("/api/users/me/")
+        return response, any(
+            "authtoken_token" in query["sql"] for query in context
+        )
+
+    def test_known_token_skips_database(self):
+        _, queried = self.get_me(self.tokens[0])
+        self.assertTrue(queried)
+        response, queried = self.get_me(self.tokens[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(queried)
+
+    def test_deactivation_revokes_tokens(self):
+        for token in self.tokens:
+            self.get_me(token)
+        user = self.users[1]
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        response, _ = self.get_me(self.tokens[1])
+        self.assertEqual(response.status_code, 401)
+        response, queried = self.get_me(self.tokens[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queried)
+
+    def test_revoke_from_another_process(self):
+        self.get_me(self.tokens[0])
+        invalidate_in_subprocess("api.authentication.token_cache", "revoke")
+        _, queried = self.get_me(self.tokens[0])
+        self.assertTrue(queried)
+
+    def test_expired_entry_is_not_used(self):
+        self.get_me(self.tokens[0])
+        with override_settings(AUTH_TOKEN_CACHE_TIMEOUT=-1):
+            self.get_me(self.tokens[1])
+        _, queried = self.get_me(self.tokens[1])
+        self.assertTrue(queried)
+        _, queried = self.get_me(self.tokens[0])
+        self.assertFalse(queried)
+
+    @override_settings(AUTH_TOKEN_CACHE_SIZE=0)
+    def test_zero_size_disables_cache(self):
+        self.get_me(self.tokens[0])
+        _, queried = self.get_me(self.tokens[0])
+        self.assertTrue(queried)
+
+    def test_logout_revokes_token(self):
+        self.get_me(self.tokens[0])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {self.tokens[0]}")
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post("/api/auth/token/logout/")
+        response, _ = self.get_me(self.tokens[0])
+        self.assertEqual(response.status_code, 401)
+
+
+class GenerationTests(TestCase):
+    """Сброс файлов, собранных на хосте, виден всем хостам.
+
+    Хосты изображаются отдельными объектами со своими каталогами;
+    поколения у них общие, как у хостов с общим GENERATIONS_CACHE.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name="Завтрак", slug="breakfast")
+        Ingredient.objects.create(name="Соль", measurement_unit="г")
+
+    def setUp(self):
+        tags_response.invalidate()
+        ingredient_index.invalidate()
+
+    def on_host(self, number, function):
+        directory = os.path.join(TEMP_DIR, f"host{number}")
+        with override_settings(PREBUILT_RESPONSES_DIR=directory):
+            return function()
+
+    def test_prebuilt_invalidate_reaches_other_hosts(self):
+        hosts = [PrebuiltJSONResponse("tags", build_tags) for _ in range(2)]
+        for number, host in enumerate(hosts):
+            self.assertEqual(len(self.on_host(number, host.payload).data), 1)
+        Tag.objects.create(name="Обед", slug="lunch")
+        hosts[0].invalidate()
+        self.assertEqual(len(self.on_host(1, hosts[1].payload).data), 2)
+
+    def test_stale_prebuilt_rebuild_is_not_saved(self):
+        host = PrebuiltJSONResponse("tags", build_tags)
+
+        def build_before_invalidate():
+            data = build_tags()
+            Tag.objects.create(name="Обед", slug="lunch")
+            host.invalidate()
+            return data
+
+        with mock.patch.object(host, "build_data", build_before_invalidate):
+            self.assertEqual(len(self.on_host(0, host.payload).data), 1)
+        self.assertEqual(len(self.on_host(0, host.payload).data), 2)
+        self.assertEqual(len(self.on_host(0, host.payload).data), 2)
+
+    def test_ingredient_index_invalidate_from_another_process(self):
+        self.assertEqual(len(ingredient_index.search("сол")), 1)
+        Ingredient.objects.create(name="Солод", measurement_unit="г")
+        invalidate_in_subprocess("recipes.search.ingredient_index")
+        self.assertEqual(len(ingredient_index.search("сол")), 2)
+
+    @override_settings(GENERATIONS_CACHE="default")
+    def test_local_generations_cache_is_rejected(self):
+        self.assertEqual(
+            [error.id for error in check_generations_cache(None)],
+            ["recipes.E001"],
+        )
+
+    def test_ingredient_index_invalidate_reaches_other_hosts(self):
+        hosts = [
+            IngredientIndex(os.path.join(TEMP_DIR, f"host{number}.idx"))
+            for number in range(2)
+        ]
+        for host in hosts:
+            self.assertEqual(len(host.search("сол")), 1)
+        Ingredient.objects.create(name="Солод", measurement_unit="г")
+        hosts[0].invalidate()
+        self.assertEqual(len(hosts[1].search("сол")), 2)
+
+
+@override_settings(PREBUILT_RESPONSES_DIR=TEMP_DIR)
+class ReferenceResponseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name="Завтрак", slug="breakfast")
+        Ingredient.objects.create(name="Соль", measurement_unit="г")
+
+    def setUp(self):
+        tags_response.invalidate()
+        ingredients_response.invalidate()
+
+    def test_import_command_rebuilds_ingredients(self):
+        worker = PrebuiltJSONResponse("ingredients", build_ingredients)
+        self.assertEqual(len(worker.payload().data), 1)
+        with open(worker.generation.path) as file:
+            generation = file.read()
+
+        path = os.path.join(TEMP_DIR, "ingredients.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("Перец,г\n")
+        # Команда шлет сигнал после коммита, а приемник сам откладывает
+        # сброс до коммита: нужен второй уровень перехвата.
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command("ingredients_import", path, stdout=io.StringIO())
+
+        with open(worker.generation.path) as file:
+            self.assertNotEqual(file.read(), generation)
+        self.assertEqual(len(worker.payload().data), 2)
+
+    def test_tag_added_elsewhere_is_a_valid_choice(self):
+        url = "/api/recipes/?tags=lunch"
+        self.assertEqual(APIClient().get(url).status_code, 400)
+        Tag.objects.create(name="Обед", slug="lunch")
+        invalidate_in_subprocess("api.cache.tags_response")
+        self.assertEqual(APIClient().get(url).status_code, 200)
+
+    def test_accept_encoding_q_values(self):
+        for header, encoding in (
+            ("gzip, br", "br"),
+            ("br;q=0, gzip", "gzip"),
+            ("gzip;q=1.0, br;q=0.5", "gzip"),
+            ("*;q=0.5, br;q=0", "gzip"),
+            ("gzip;q=0, br;Q=0", None),
+            ("*;q=0", None),
+            ("identity", None),
+        ):
+            with self.subTest(header=header):
+                response = APIClient().get(
+                    "/api/tags/", HTTP_ACCEPT_ENCODING=header
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get("Content-Encoding"), encoding)
+
+    def test_if_none_match_star(self):
+        response = APIClient().get("/api/tags/", HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(response.has_header("ETag"))
+
+
+@override_settings(MEDIA_ROOT=TEMP_DIR, JOBS_EAGER=True)
+class ImageFileTests(TestCase):
+    """Замененные и удаленные изображения не остаются в хранилище."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username="author",
+            email="author@example.com",
+            password="Author-password-1",
+        )
+
+    def upload(self, name):
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4), (200, 120, 40)).save(buffer, format="PNG")
+        return ContentFile(buffer.getvalue(), name)
+
+    def assertStored(self, name, stored=True):
+        for stored_name in stored_names(name):
+            self.assertEqual(default_storage.exists(stored_name), stored)
+
+    @override_settings(MAX_IMAGE_SIZE=1024)
+    def test_upload_limit_applies_to_image_endpoints(self):
+        self.assertEqual(
+            settings.FILE_UPLOAD_HANDLERS,
+            global_settings.FILE_UPLOAD_HANDLERS,
+        )
+        client = APIClient()
+        client.force_authenticate(self.author)
+        for method, url, field in (
+            ("put", "/api/users/me/avatar/", "avatar"),
+            ("post", "/api/recipes/", "image"),
+        ):
+            with self.subTest(url=url):
+                response = getattr(client, method)(
+                    url,
+                    {field: ContentFile(os.urandom(4096), "big.png")},
+                    format="multipart",
+                )
+                self.assertEqual(response.status_code, 400)
+                # Отказ при чтении тела, а не после записи файла целиком.
+                self.assertIn("Файл больше", response.data["detail"])
+
+    def test_recipe_image_files_follow_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.author,
+                name="Рецепт",
+                text="Описание",
+                image=self.upload("first.png"),
+                cooking_time=5,
+            )
+        first = recipe.image.name
+        self.assertStored(first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = "Переименованный рецепт"
+            recipe.save()
+        self.assertStored(first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.image = self.upload("second.png")
+            recipe.save()
+        second = recipe.image.name
+        self.assertStored(first, stored=False)
+        self.assertStored(second)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertStored(second, stored=False)
+
+    def test_replaced_avatar_files_are_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.avatar = self.upload("first.png")
+            self.author.save()
+        first = self.author.avatar.name
+        self.assertStored(first)
+
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.put(
+                "/api/users/me/avatar/",
+                {"avatar": image_data()},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.author.refresh_from_db()
+        self.assertStored(first, stored=False)
+        self.assertStored(self.author.avatar.name)
+        self.assertEqual(
+            Job.objects.filter(name="images.delete_files").count(), 1
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_DIR, PREBUILT_RESPONSES_DIR=TEMP_DIR)
+class CounterTests(TestCase):
+    """Счетчики меняются через F(): полное сохранение их не затирает."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader = (
+            User.objects.create_user(
+                username=name,
+                email=f"{name}@example.com",
+                password="User-password-1",
+            )
+            for name in ("author", "reader")
+        )
+        cls.author_token = Token.objects.create(user=cls.author).key
+        cls.reader_token = Token.objects.create(user=cls.reader).key
+        cls.tag = Tag.objects.create(name="Завтрак", slug="breakfast")
+        cls.ingredient = Ingredient.objects.create(
+            name="Мука", measurement_unit="г"
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name="Рецепт",
+            text="Описание",
+            image="recipes/images/test.jpg",
+            cooking_time=10,
+        )
+
+    def client_for(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        return client
+
+    def test_recipe_patch_between_favorite_toggles(self):
+        url = f"/api/recipes/{self.recipe.pk}/favorite/"
+        reader = self.client_for(self.reader_token)
+        # PATCH прочитал рецепт до того, как его добавили в избранное.
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(reader.post(url).status_code, 201)
+        with mock.patch.object(
+            RecipeViewSet, "get_object", return_value=stale
+        ):
+            response = self.client_for(self.author_token).patch(
+                f"/api/recipes/{self.recipe.pk}/",
+                {
+                    "name": "Новое название",
+                    "text": "Описание",
+                    "cooking_time": 15,
+                    "tags": [self.tag.pk],
+                    "ingredients": [{"id": self.ingredient.pk, "amount": 5}],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, "Новое название")
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(reader.delete(url).status_code, 204)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_stale_user_save_keeps_counters(self):
+        stale = User.objects.get(pk=self.author.pk)
+        response = self.client_for(self.reader_token).post(
+            f"/api/users/{self.author.pk}/subscribe/"
+        )
+        self.assertEqual(response.status_code, 201)
+        stale.first_name = "Автор"
+        stale.save()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.first_name, "Автор")
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_stale_user_save_keeps_state_changed_at(self):
+        stale = User.objects.get(pk=self.reader.pk)
+        response = self.client_for(self.reader_token).post(
+            f"/api/recipes/{self.recipe.pk}/shopping_cart/"
+        )
+        self.assertEqual(response.status_code, 201)
+        changed_at = User.objects.get(pk=self.reader.pk).state_changed_at
+        self.assertGreater(changed_at, stale.state_changed_at)
+        stale.last_name = "Читатель"
+        stale.save()
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.state_changed_at, changed_at)
+
+    def test_shopping_list_follows_cart(self):
+        second = Recipe.objects.create(
+            author=self.author,
+            name="Второй рецепт",
+            text="Описание",
+            image="recipes/images/test.jpg",
+            cooking_time=10,
+        )
+        for recipe, amount in ((self.recipe, 100), (second, 30)):
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=amount
+            )
+        reader = self.client_for(self.reader_token)
+        items = ShoppingListItem.objects.filter(user=self.reader)
+        for recipe in (self.recipe, second):
+            reader.post(f"/api/recipes/{recipe.pk}/shopping_cart/")
+        self.assertEqual(list(items.values_list("amount", flat=True)), [130])
+        reader.delete(f"/api/recipes/{self.recipe.pk}/shopping_cart/")
+        self.assertEqual(list(items.values_list("amount", flat=True)), [30])
+        reader.delete(f"/api/recipes/{second.pk}/shopping_cart/")
+        self.assertFalse(items.exists())
+
+    def test_cart_row_rolls_back_with_shopping_list(self):
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=100
+        )
+        with mock.patch.object(
+            ShoppingListItem.objects,
+            "apply_deltas",
+            side_effect=DatabaseError,
+        ), self.assertRaises(DatabaseError):
+            self.client_for(self.reader_token).post(
+                f"/api/recipes/{self.recipe.pk}/shopping_cart/"
+            )
+        self.assertFalse(
+            ShoppingCart.objects.filter(user=self.reader).exists()
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 0)
+
+
+@modify_settings(
+    MIDDLEWARE={"prepend": "api.middleware.SQLInstrumentationMiddleware"}
+)
+class SQLInstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username="author",
+            email="author@example.com",
+            password="Author-password-1",
+        )
+        for number in range(3):
+            Recipe.objects.create(
+                author=author,
+                name=f"Рецепт {number}",
+                text="Описание",
+                image="recipes/images/test.jpg",
+                cooking_time=10,
+            )
+
+    def test_headers_count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = APIClient().get("/api/recipes/")
+        self.assertEqual(response["X-DB-Queries"], str(len(context)))
+        self.assertRegex(
+            response["Server-Timing"],
+            rf'^db;dur=\d+\.\d;desc="{len(context)} queries", '
+            r"total;dur=\d+\.\d$",
+        )
+
+    @override_settings(SLOW_REQUEST_QUERIES=0)
+    def test_slow_request_is_logged_with_fingerprints(self):
+        with self.assertLogs("api.sql", "WARNING") as logs:
+            APIClient().get("/api/recipes/?limit=2")
+        message = logs.records[0].getMessage()
+        self.assertIn(
+            "Медленный запрос GET /api/recipes/?limit=2 (api:recipe-list)",
+            message,
+        )
+        self.assertRegex(message, r"\n\d+ x \[[0-9a-f]{8}\] SELECT ")
+
+    @override_settings(SLOW_REQUEST_QUERIES=100, SLOW_REQUEST_MS=60000)
+    def test_fast_request_is_not_logged(self):
+        with mock.patch.object(middleware.logger, "warning") as warning:
+            APIClient().get("/api/recipes/")
+        warning.assert_not_called()
+
+    def test_recorder_groups_queries_by_fingerprint(self):
+        recorder = middleware.QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for recipe in Recipe.objects.all():
+                User.objects.get(pk=recipe.author_id)
+            list(Recipe.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(recorder.count, 5)
+        (sql, count), *_ = recorder.fingerprints()
+        self.assertEqual(count, 3)
+        self.assertIn('"users_user"."id" = ?', sql)
+        self.assertIn(
+            "IN (...)",
+            middleware.fingerprint(
+                "SELECT 1 FROM t WHERE id IN (1, 2, 3) AND name = 'a''b'"
+            ),
+        )
+
+    def test_setting_toggles_middleware(self):
+        def middleware_list(**env):
+            environ = {
+                key: value
+                for key, value in os.environ.items()
+                if key != "SQL_INSTRUMENTATION"
+            }
+            return json.loads(
+                subprocess.run(
+                    [
+                        sys.executable,
+                        "-c",
+                        "import json; from foodgram_backend import settings; "
+                        "print(json.dumps(settings.MIDDLEWARE))",
+                    ],
+                    check=True,
+                    capture_output=True,
+                    cwd=settings.BASE_DIR,
+                    env={**environ, **env},
+                ).stdout
+            )
+
+        default = middleware_list()
+        self.assertEqual(default, middleware_list(SQL_INSTRUMENTATION=""))
+        path = "api.middleware.SQLInstrumentationMiddleware"
+        self.assertNotIn(path, default)
+        self.assertEqual(
+            middleware_list(SQL_INSTRUMENTATION="True"), [path, *default]
+        )
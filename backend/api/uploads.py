@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from django.template.defaultfilters import filesizeformat
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загружаемый файл во временный файл частями по chunk_size.
+
+    Память на загрузку не зависит от размера файла, а слишком большой
+    файл отклоняется, как только прочитано больше MAX_IMAGE_SIZE байт.
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.MAX_IMAGE_SIZE:
+            raise MultiPartParserError(
+                f"Файл больше {filesizeformat(settings.MAX_IMAGE_SIZE)}."
+            )
+        return super().receive_data_chunk(raw_data, start)
+
+
+class LimitedUploadMixin:
+    """Принимает файлы вью через LimitedTemporaryFileUploadHandler.
+
+    Обработчик ставится только на эндпоинты с изображениями; остальные
+    загрузки идут через FILE_UPLOAD_HANDLERS Django.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
@@ -2,9 +2,10 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from api.views import (AvatarUpdateView, FavoriteViewSet, IngredientViewSet,
-                       NewUserViewSet, RecipeViewSet, ShoppingCartDownloadView,
-                       ShoppingCartViewSet, SubscribeViewSet,
-                       SubscriptionListAPI, TagViewSet, UserGetViewSet)
+                       JobViewSet, NewUserViewSet, RecipeViewSet,
+                       ShoppingCartDownloadView, ShoppingCartViewSet,
+                       SubscribeViewSet, SubscriptionListAPI, TagViewSet,
+                       UserGetViewSet)
 
 app_name = "api"
 
@@ -13,6 +14,7 @@ v1_router = DefaultRouter()
 v1_router.register(r"tags", TagViewSet, basename="tag")
 v1_router.register(r"ingredients", IngredientViewSet, basename="ingredient")
 v1_router.register(r"recipes", RecipeViewSet, basename="recipe")
+v1_router.register(r"jobs", JobViewSet, basename="job")
 
 
 urlpatterns = [
@@ -1,31 +1,49 @@
+import hashlib
+from functools import partial
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Exists, OuterRef
+from django.db import transaction
+from django.db.models import (DateTimeField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import NoReverseMatch, reverse
+from django.utils.http import parse_etags, quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import UserSerializer
 from djoser.views import UserViewSet
 from rest_framework import generics, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import (SAFE_METHODS, AllowAny,
                                         IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.cache import (conditional_response, ingredients_response,
+                       recipe_fragments, tags_response)
 from api.filters import IngredientFilter, RecipeFilter
 from api.pagination import FoodgramPagination
+from api.parsers import MultiPartJSONParser
 from api.permissions import ActionRestriction, IsAuthorOrStaff
-from api.renderers import PlainTextRenderer
+from api.renderers import (CSVRenderer, PlainTextRenderer,
+                           ShoppingListJSONRenderer)
 from api.serializers import (AvatarSerializer, FavoriteSerializer,
-                             IngredientSerializer, NewUserSerializer,
-                             RecipeIWriteSerializer, RecipeReadSerializer,
-                             ShoppingCartSerializer, SubscribeActionSerializer,
-                             SubscriptionSerializer, TagSerializer,
-                             UserCreateSerializer)
+                             IngredientSerializer, JobSerializer,
+                             NewUserSerializer, RecipeIWriteSerializer,
+                             RecipeReadSerializer, ShoppingCartSerializer,
+                             SubscribeActionSerializer, SubscriptionSerializer,
+                             TagSerializer, UserCreateSerializer)
+from api.uploads import LimitedUploadMixin
+from jobs.models import Job
+from recipes.generations import recipes_generation
+from recipes.images import stored_names
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingListItem, Tag, TimelineEntry)
+from recipes.search import ingredient_index
+from recipes.shortlinks import decode
 from users.models import Subscription
 
 User = get_user_model()
@@ -81,8 +99,12 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    authentication_classes = ()
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return tags_response.response(request)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """list() и retrieve() для модели Ingridient."""
@@ -92,47 +114,78 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    authentication_classes = ()
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        """Поиск по ?name= идет по индексу в памяти, без запросов к БД.
+
+        При ?fuzzy=true или если точных совпадений нет, ищутся похожие
+        названия с учетом опечаток и неверной раскладки.
+        """
+        name = request.query_params.get("name")
+        if not name:
+            return ingredients_response.response(request)
+        fuzzy = request.query_params.get("fuzzy", "").lower()
+        if fuzzy not in ("1", "true"):
+            found = ingredient_index.search(name)
+            if found:
+                return Response(found)
+        return Response(ingredient_index.fuzzy_search(name))
+
 
 class ShoppingCartDownloadView(APIView):
     """Скачивание списка покупок."""
 
-    renderer_classes = (PlainTextRenderer,)
+    renderer_classes = (
+        PlainTextRenderer,
+        CSVRenderer,
+        ShoppingListJSONRenderer,
+    )
     permission_classes = (IsAuthenticated,)
 
     def get(self, request, format=None):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__cart_users__user=request.user
-        ).select_related("ingredient")
+        """С ?deferred=true файл готовит воркер, а в ответе — задача."""
+        renderer = request.accepted_renderer
+        if request.query_params.get("deferred", "").lower() in ("1", "true"):
+            job = Job.objects.enqueue(
+                "shopping_list.render",
+                user=request.user,
+                user_id=request.user.id,
+                format=renderer.format,
+            )
+            return Response(
+                JobSerializer(job).data,
+                status=status.HTTP_202_ACCEPTED,
+                headers={
+                    "Location": request.build_absolute_uri(
+                        reverse("api:job-detail", args=[job.id])
+                    )
+                },
+            )
 
-        content = self.create_file(ingredients)
+        ingredients = ShoppingListItem.objects.for_download(request.user.id)
 
-        response = Response(content)
+        etag = quote_etag(
+            hashlib.md5(
+                f"{renderer.format}:{ingredients}".encode()
+            ).hexdigest()
+        )
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            return response
+
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response["ETag"] = etag
         response[
             "Content-Disposition"
-        ] = 'attachment; filename="products_list.txt"'
+        ] = f'attachment; filename="products_list.{renderer.format}"'
         return response
 
-    def create_file(self, ingredients):
-        """Создает содержимое файла на основе элементов корзины."""
-        in_cart = {}
-
-        for ingredient in ingredients:
-            ingredient_name = ingredient.ingredient.name
-            measurement_unit = ingredient.ingredient.measurement_unit
-            amount = ingredient.amount
-
-            in_cart[(ingredient_name, measurement_unit)] = (
-                in_cart.get((ingredient_name, measurement_unit), 0) + amount
-            )
-
-        cart = [
-            f"{key[0]} - {value}({key[1]})" for key, value in in_cart.items()
-        ]
-        content = "\n".join(cart)
-        return content
-
 
 class ReturnShortLinkRecipeAPI(APIView):
     """Перенаправляет на объект рецепта по короткой ссылке."""
@@ -140,35 +193,199 @@ class ReturnShortLinkRecipeAPI(APIView):
     permission_classes = (ActionRestriction,)
 
     def get(self, request, short_link):
-        recipe = get_object_or_404(Recipe, short_link=short_link)
-        recipe_url = f"{settings.BASE_URL}/recipes/{recipe.id}/"
-        return redirect(recipe_url)
+        """Код нового формата раскодируется в id без запроса к БД.
+
+        Старые ссылки из uuid по-прежнему ищутся по полю short_link.
+        """
+        recipe_id = decode(short_link)
+        if recipe_id is None:
+            recipe_id = get_object_or_404(Recipe, short_link=short_link).id
+        return redirect(f"{settings.BASE_URL}/recipes/{recipe_id}/")
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(LimitedUploadMixin, viewsets.ModelViewSet):
     """CRUD для модели Recipe."""
 
     permission_classes = (IsAuthorOrStaff,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    parser_classes = (JSONParser, MultiPartJSONParser)
+    multipart_json_fields = ("ingredients", "tags")
+
+    @property
+    def cursor_ordering(self):
+        """Ключ курсора; при ?search= страницы идут по номеру.
+
+        Поиск сортирует по релевантности, а курсор по дате заменил бы
+        этот порядок своим, поэтому ?cursor= с поиском не действует.
+        """
+        if self.request.query_params.get("search", "").strip():
+            return None
+        return ("-pub_date", "-id")
+
+    @property
+    def viewer(self):
+        if self.request.user.is_authenticated:
+            return self.request.user
+        return None
+
+    def viewer_flags(self):
+        """Аннотации рецепта, зависящие от текущего пользователя."""
+        return {
+            "is_favorited": Exists(
+                Favorite.objects.filter(
+                    user=self.viewer, recipe=OuterRef("pk")
+                )
+            ),
+            "is_in_shopping_cart": Exists(
+                ShoppingCart.objects.filter(
+                    user=self.viewer, recipe=OuterRef("pk")
+                )
+            ),
+        }
 
     def get_queryset(self):
-        user = (
-            self.request.user if self.request.user.is_authenticated else None
-        )
         return (
-            Recipe.objects.prefetch_related("ingredients", "tags")
-            .select_related("author")
-            .annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+            Recipe.objects.prefetch_related(
+                "tags",
+                Prefetch(
+                    "recipe_ingredients",
+                    queryset=IngredientRecipe.objects.select_related(
+                        "ingredient"
+                    ),
                 ),
-                is_in_shopping_cart=Exists(
-                    ShoppingCart.objects.filter(
-                        user=user, recipe=OuterRef("pk")
-                    )
+                Prefetch(
+                    "author",
+                    queryset=User.objects.annotate(
+                        is_subscribed=Exists(
+                            Subscription.objects.filter(
+                                user=self.viewer, subscribed_to=OuterRef("pk")
+                            )
+                        )
+                    ),
                 ),
             )
+            .annotate(**self.viewer_flags())
+        )
+
+    def fragment_queryset(self):
+        """Рецепты с полями, которых хватает для recipe_fragments."""
+        return Recipe.objects.only(
+            "id", "author_id", "pub_date", "updated_at"
+        ).annotate(
+            **self.viewer_flags(),
+            is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=self.viewer, subscribed_to=OuterRef("author_id")
+                )
+            ),
+        )
+
+    def list_page(self, request):
+        """Страница списка из кэша фрагментов рецептов.
+
+        Из БД выбираются только id, версии и отметки пользователя, а тела
+        рецептов берутся из recipe_fragments; сериализуются лишь промахи.
+        """
+        queryset = self.filter_queryset(self.fragment_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(recipe_fragments.render(list(queryset)))
+        return self.get_paginated_response(recipe_fragments.render(page))
+
+    def viewer_state(self):
+        """Запрос отметки изменения избранного, корзины и подписок."""
+        return User.objects.filter(pk=self.request.user.pk).values(
+            "state_changed_at"
+        )
+
+    def list(self, request, *args, **kwargs):
+        """Список с ETag по поколению рецептов и отметке пользователя.
+
+        Поколение recipes_generation меняют сигналы при сохранении,
+        удалении и касании рецептов, так что версия не требует выборки
+        из таблицы рецептов. Повторный запрос с If-None-Match стоит
+        одного запроса по ключу пользователя. Last-Modified не отдается:
+        удаление рецепта не сдвигает ни одну из дат.
+        """
+        viewer_changed_at = None
+        if request.user.is_authenticated:
+            viewer_changed_at = self.viewer_state().first()["state_changed_at"]
+        return conditional_response(
+            request,
+            (
+                request.get_full_path(),
+                recipes_generation.current(),
+                viewer_changed_at,
+            ),
+            partial(self.list_page, request),
+            last_modified=False,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        """Рецепт с ETag: для 304 хватает одного запроса по ключу."""
+        if not str(kwargs["pk"]).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        viewer_changed_at = Value(None, output_field=DateTimeField())
+        if request.user.is_authenticated:
+            viewer_changed_at = Subquery(self.viewer_state())
+        version = (
+            Recipe.objects.filter(pk=kwargs["pk"])
+            .annotate(viewer_changed_at=viewer_changed_at)
+            .values_list("updated_at", "viewer_changed_at")
+            .first()
+        )
+        if version is None:
+            return super().retrieve(request, *args, **kwargs)
+        return conditional_response(
+            request,
+            (request.get_full_path(), *version),
+            partial(super().retrieve, request, *args, **kwargs),
+        )
+
+    @action(
+        detail=False, methods=["get"], permission_classes=(IsAuthenticated,)
+    )
+    def feed(self, request):
+        """Рецепты авторов из подписок, новые сверху, по курсору.
+
+        Рецепты обычных авторов читаются из ленты TimelineEntry, куда их
+        копирует задача feed.fan_out. Авторов, у которых не меньше
+        FEED_CELEBRITY_THRESHOLD подписчиков, в ленту не копируют: их
+        рецепты выбираются из Recipe и сливаются со страницей ленты.
+        """
+        celebrities = list(
+            User.objects.filter(
+                subscribers__user=request.user,
+                subscribers_count__gte=settings.FEED_CELEBRITY_THRESHOLD,
+            ).values_list("id", flat=True)
+        )
+        sources = [
+            (
+                TimelineEntry.objects.filter(user=request.user)
+                .exclude(author_id__in=celebrities)
+                .only("recipe", "pub_date"),
+                ("-pub_date", "-recipe_id"),
+            )
+        ]
+        if celebrities:
+            sources.append(
+                (
+                    Recipe.objects.filter(author_id__in=celebrities).only(
+                        "id", "pub_date"
+                    ),
+                    ("-pub_date", "-id"),
+                )
+            )
+        ids = [
+            item.recipe_id if isinstance(item, TimelineEntry) else item.pk
+            for item in self.paginator.paginate_merged(sources, request)
+        ]
+        recipes = self.fragment_queryset().in_bulk(ids)
+        return self.paginator.get_paginated_response(
+            recipe_fragments.render(
+                [recipes[pk] for pk in ids if pk in recipes]
+            )
         )
 
     @action(detail=True, methods=["get"], url_path="get-link")
@@ -202,7 +419,9 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
     serializer_class = ShoppingCartSerializer
     queryset = ShoppingCart.objects.all()
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
+        """Строка корзины и сводный список покупок пишутся вместе."""
         recipe_id = kwargs.get("recipe_id")
         recipe = get_object_or_404(Recipe, id=recipe_id)
         serializer = self.get_serializer(
@@ -218,6 +437,7 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def destroy(self, request, *args, **kwargs):
         recipe_id = kwargs.get("recipe_id")
         deleted_count, _ = ShoppingCart.objects.filter(
@@ -273,13 +493,13 @@ class SubscriptionListAPI(generics.ListAPIView):
 
     serializer_class = SubscriptionSerializer
     permission_classes = (IsAuthenticated,)
+    cursor_ordering = ("id",)
 
     def get_queryset(self):
         current_user = self.request.user
         return (
             User.objects.filter(subscribers__user=current_user)
             .annotate(
-                recipes_count=Count("recipes"),
                 is_subscribed=Exists(
                     Subscription.objects.filter(
                         user=current_user, subscribed_to=OuterRef("pk")
@@ -330,12 +550,13 @@ class SubscribeViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class AvatarUpdateView(generics.UpdateAPIView):
+class AvatarUpdateView(LimitedUploadMixin, generics.UpdateAPIView):
     """Обновление / удаление аватара."""
 
     queryset = User.objects.all()
     serializer_class = AvatarSerializer
     permission_classes = (IsAuthenticated,)
+    parser_classes = (JSONParser, MultiPartParser)
 
     def put(self, request, *args, **kwargs):
         user = request.user
@@ -347,5 +568,19 @@ class AvatarUpdateView(generics.UpdateAPIView):
     def delete(self, request, *args, **kwargs):
         user = request.user
         if user.avatar:
-            user.avatar.delete()
+            Job.objects.enqueue(
+                "images.delete_files", names=stored_names(user.avatar.name)
+            )
+            user.avatar = None
+            user.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Состояние фоновых задач текущего пользователя."""
+
+    serializer_class = JobSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
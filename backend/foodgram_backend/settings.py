@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
     "recipes.apps.RecipesConfig",
     "users.apps.UsersConfig",
     "api.apps.ApiConfig",
+    "jobs.apps.JobsConfig",
 ]
 
 MIDDLEWARE = [
@@ -47,6 +49,26 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION") == "True"
+
+SLOW_REQUEST_QUERIES = int(os.getenv("SLOW_REQUEST_QUERIES", 20))
+
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", 500))
+
+if SQL_INSTRUMENTATION:
+    MIDDLEWARE.insert(0, "api.middleware.SQLInstrumentationMiddleware")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api.sql": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
+
 ROOT_URLCONF = "foodgram_backend.urls"
 
 TEMPLATES = [
@@ -116,12 +138,65 @@ MEDIA_ROOT = "/app/media/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+INGREDIENT_INDEX_PATH = os.getenv(
+    "INGREDIENT_INDEX_PATH",
+    os.path.join(tempfile.gettempdir(), "foodgram_ingredients.idx"),
+)
+
+MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", 10 * 2**20))
+
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 40_000_000))
+
+JOBS_EAGER = os.getenv("JOBS_EAGER") == "True"
+
+SHOPPING_LIST_FILE_TTL = int(os.getenv("SHOPPING_LIST_FILE_TTL", 24 * 3600))
+
+SHORT_LINK_KEY = os.getenv("SHORT_LINK_KEY", "foodgram-short-links")
+
+PREBUILT_RESPONSES_DIR = os.getenv(
+    "PREBUILT_RESPONSES_DIR",
+    os.path.join(tempfile.gettempdir(), "foodgram_responses"),
+)
+
+REFERENCE_CACHE_MAX_AGE = int(os.getenv("REFERENCE_CACHE_MAX_AGE", 300))
+
+GENERATIONS_DIR = os.getenv(
+    "GENERATIONS_DIR",
+    os.path.join(tempfile.gettempdir(), "foodgram_generations"),
+)
+
+GENERATIONS_CACHE = os.getenv("GENERATIONS_CACHE", "")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "recipes": {
+        "BACKEND": os.getenv(
+            "RECIPE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("RECIPE_CACHE_LOCATION", "recipes"),
+        "TIMEOUT": int(os.getenv("RECIPE_CACHE_TIMEOUT", 3600)),
+    },
+}
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 1024))
+
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv("AUTH_TOKEN_CACHE_TIMEOUT", 60))
+
+FEED_CELEBRITY_THRESHOLD = int(os.getenv("FEED_CELEBRITY_THRESHOLD", 1000))
+
+FEED_FANOUT_BATCH = int(os.getenv("FEED_FANOUT_BATCH", 1000))
+
+FEED_BACKFILL_LIMIT = int(os.getenv("FEED_BACKFILL_LIMIT", 50))
+
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
@@ -130,6 +205,8 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 6,
 }
 
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 100))
+
 DJOSER = {
     "USERNAME_FIELD": "email",
     "SERIALIZERS": {
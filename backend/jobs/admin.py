@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "user", "created_at")
+    list_filter = ("status", "name")
+    search_fields = ("name",)
+    readonly_fields = (
+        "name",
+        "payload",
+        "user",
+        "attempts",
+        "locked_at",
+        "created_at",
+        "finished_at",
+        "result",
+        "error",
+    )
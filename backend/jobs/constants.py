@@ -0,0 +1,11 @@
+JOB_NAME_LENGTH = 128
+"""Максимальная длина имени задачи."""
+
+MAX_ATTEMPTS = 3
+"""Сколько раз запускать задачу, прежде чем пометить ее ошибочной."""
+
+RETRY_DELAY = 30
+"""Задержка перед повтором в секундах, удваивается с каждой попыткой."""
+
+LOCK_TIMEOUT = 600
+"""Через сколько секунд задачу зависшего воркера можно забрать снова."""
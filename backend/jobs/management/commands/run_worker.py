@@ -0,0 +1,112 @@
+import multiprocessing
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections
+
+from jobs.models import Job
+from jobs.registry import run_job
+
+
+def execute(job_id):
+    """Выполняет задачу в потоке или процессе пула."""
+    close_old_connections()
+    try:
+        return job_id, run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "Run background jobs from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Сколько задач выполнять одновременно.",
+        )
+        parser.add_argument(
+            "--pool",
+            choices=("thread", "process"),
+            default="thread",
+            help="Выполнять задачи в потоках или в отдельных процессах.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Пауза в секундах, когда очередь пуста.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить все готовые задачи и завершиться.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        if concurrency < 1:
+            raise CommandError("--concurrency должен быть больше нуля.")
+
+        if options["pool"] == "process":
+            # spawn: дочерние процессы не наследуют соединения с БД.
+            executor = ProcessPoolExecutor(
+                concurrency,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=django.setup,
+            )
+        else:
+            executor = ThreadPoolExecutor(concurrency)
+
+        self.stdout.write(
+            f"Воркер запущен: {options['pool']} x {concurrency}."
+        )
+        running = set()
+        done = failed = 0
+        try:
+            while True:
+                free = concurrency - len(running)
+                try:
+                    ids = Job.objects.claim(free) if free else []
+                except OperationalError:
+                    # БД недоступна или, в SQLite, занята записью другого
+                    # потока: пробуем снова на следующем круге.
+                    close_old_connections()
+                    ids = []
+                running.update(executor.submit(execute, pk) for pk in ids)
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                finished, running = wait(
+                    running,
+                    timeout=options["poll_interval"],
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in finished:
+                    job_id, ok = future.result()
+                    done += ok
+                    failed += not ok
+                    if not ok:
+                        self.stdout.write(
+                            self.style.WARNING(
+                                f"Задача {job_id} завершилась ошибкой."
+                            )
+                        )
+        except KeyboardInterrupt:
+            self.stdout.write("Остановка: ждем выполняющиеся задачи.")
+        finally:
+            executor.shutdown(wait=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Выполнено задач: {done}, с ошибкой: {failed}."
+            )
+        )
@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from jobs.constants import JOB_NAME_LENGTH, LOCK_TIMEOUT, MAX_ATTEMPTS
+
+User = get_user_model()
+
+
+class JobQuerySet(models.QuerySet):
+    def enqueue(self, name, user=None, run_at=None, **payload):
+        """Ставит задачу в очередь в текущей транзакции.
+
+        Воркер увидит задачу только после коммита, поэтому она не
+        запустится раньше, чем сохранятся данные, с которыми работает.
+        run_at откладывает запуск до указанного момента.
+        """
+        from jobs.registry import run_eagerly
+
+        job = self.create(
+            name=name,
+            user=user,
+            payload=payload,
+            run_at=run_at or timezone.now(),
+        )
+        run_eagerly(job)
+        return job
+
+    def start(self, ids):
+        self.filter(pk__in=ids).update(
+            status=Job.RUNNING,
+            locked_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+
+    def claim(self, limit):
+        """Забирает до limit задач, готовых к запуску.
+
+        SELECT ... FOR UPDATE SKIP LOCKED пропускает строки, которые
+        прямо сейчас забирает другой воркер, поэтому воркеры не ждут друг
+        друга и не берут одну задачу дважды. Задачи, заблокированные
+        дольше LOCK_TIMEOUT, считаются брошенными и забираются снова, если
+        попытки не кончились; иначе они помечаются ошибочными, чтобы
+        задача, которая роняет воркер, не перезапускалась бесконечно.
+        """
+        now = timezone.now()
+        abandoned = Q(
+            status=Job.RUNNING,
+            locked_at__lt=now - timedelta(seconds=LOCK_TIMEOUT),
+        )
+        with transaction.atomic():
+            self.filter(abandoned, attempts__gte=F("max_attempts")).update(
+                status=Job.FAILED,
+                error=(
+                    f"Воркер не завершил задачу за {LOCK_TIMEOUT} с, "
+                    "попытки исчерпаны."
+                ),
+                locked_at=None,
+                finished_at=now,
+            )
+            ids = list(
+                self.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=Job.PENDING, run_at__lte=now)
+                    | Q(abandoned, attempts__lt=F("max_attempts"))
+                )
+                .order_by("run_at", "id")
+                .values_list("id", flat=True)[:limit]
+            )
+            self.start(ids)
+        return ids
+
+
+class Job(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Выполнена"),
+        (FAILED, "Ошибка"),
+    )
+
+    name = models.CharField("Задача", max_length=JOB_NAME_LENGTH)
+    payload = models.JSONField("Аргументы", default=dict)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="jobs",
+        null=True,
+        blank=True,
+        verbose_name="Пользователь",
+    )
+    status = models.CharField(
+        "Статус", max_length=16, choices=STATUSES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        "Максимум попыток", default=MAX_ATTEMPTS
+    )
+    run_at = models.DateTimeField("Запустить не раньше", default=timezone.now)
+    locked_at = models.DateTimeField("Взята воркером", null=True, blank=True)
+    created_at = models.DateTimeField("Создана", auto_now_add=True)
+    finished_at = models.DateTimeField("Завершена", null=True, blank=True)
+    result = models.JSONField("Результат", null=True, blank=True)
+    error = models.TextField("Ошибка", blank=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Задача"
+        verbose_name_plural = "Задачи"
+        ordering = ["-id"]
+        indexes = [
+            models.Index(
+                fields=["status", "run_at"], name="job_status_run_at_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}: {self.get_status_display()}"
@@ -0,0 +1,95 @@
+"""Реестр фоновых задач и их выполнение.
+
+Задачи объявляются в модулях tasks.py приложений декоратором task и
+ставятся в очередь через Job.objects.enqueue(имя, **аргументы).
+Аргументы сохраняются в JSON, поэтому передавать нужно id, а не
+объекты моделей.
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from jobs.constants import RETRY_DELAY
+from jobs.models import Job
+
+TASKS = {}
+
+
+def task(name):
+    """Регистрирует функцию как задачу с именем name."""
+
+    def register(function):
+        TASKS[name] = function
+        return function
+
+    return register
+
+
+def run_job(job_id):
+    """Выполняет взятую воркером задачу; True, если она завершилась.
+
+    locked_at, записанный при взятии, служит меткой владельца: если
+    задачу забрал другой воркер после LOCK_TIMEOUT, обновления этого
+    воркера не совпадут с меткой и не затрут чужой статус и результат.
+    """
+    job = Job.objects.get(pk=job_id)
+    jobs = Job.objects.filter(
+        pk=job_id, status=Job.RUNNING, locked_at=job.locked_at
+    )
+    function = TASKS.get(job.name)
+    if function is None:
+        jobs.update(
+            status=Job.FAILED,
+            error=f"Неизвестная задача: {job.name}",
+            locked_at=None,
+            finished_at=timezone.now(),
+        )
+        return False
+
+    try:
+        result = function(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+            jobs.update(
+                status=Job.PENDING,
+                error=error,
+                locked_at=None,
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            jobs.update(
+                status=Job.FAILED,
+                error=error,
+                locked_at=None,
+                finished_at=timezone.now(),
+            )
+        return False
+
+    return bool(
+        jobs.update(
+            status=Job.DONE,
+            result=result,
+            error="",
+            locked_at=None,
+            finished_at=timezone.now(),
+        )
+    )
+
+
+def run_eagerly(job):
+    """При JOBS_EAGER выполняет задачу сразу после коммита, без воркера.
+
+    Отложенные задачи (run_at в будущем) остаются в очереди для воркера.
+    """
+    if settings.JOBS_EAGER and job.run_at <= timezone.now():
+
+        def run():
+            Job.objects.start([job.pk])
+            run_job(job.pk)
+
+        transaction.on_commit(run)
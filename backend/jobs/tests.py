@@ -0,0 +1,79 @@
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api.tasks import render_shopping_list
+from jobs.constants import LOCK_TIMEOUT, MAX_ATTEMPTS
+from jobs.models import Job
+from jobs.registry import run_job, task
+
+
+@task("tests.reclaimed")
+def reclaimed(job_id):
+    """Пока задача выполняется, ее забирает другой воркер."""
+    Job.objects.filter(pk=job_id).update(locked_at=timezone.now(), attempts=2)
+    return {"owner": "first"}
+
+
+class QueueTests(TestCase):
+    def abandoned(self, attempts):
+        """Задача, воркер которой пропал дольше LOCK_TIMEOUT назад."""
+        return Job.objects.create(
+            name="images.delete_files",
+            payload={"names": []},
+            status=Job.RUNNING,
+            attempts=attempts,
+            locked_at=timezone.now() - timedelta(seconds=LOCK_TIMEOUT + 1),
+        )
+
+    def test_abandoned_job_is_retried_while_attempts_remain(self):
+        job = self.abandoned(attempts=1)
+        self.assertEqual(Job.objects.claim(10), [job.pk])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.attempts, 2)
+
+    def test_abandoned_job_without_attempts_fails(self):
+        job = self.abandoned(attempts=MAX_ATTEMPTS)
+        self.assertEqual(Job.objects.claim(10), [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNone(job.locked_at)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_reclaimed_job_keeps_new_owner_state(self):
+        job = Job.objects.create(name="tests.reclaimed")
+        job.payload = {"job_id": job.pk}
+        job.save()
+        Job.objects.start([job.pk])
+        self.assertFalse(run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertIsNone(job.result)
+        self.assertIsNotNone(job.locked_at)
+
+
+class ShoppingListFileTests(TestCase):
+    def test_rendered_file_is_deleted_after_ttl(self):
+        user = get_user_model().objects.create_user(
+            username="buyer", email="buyer@example.com", password="x"
+        )
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            MEDIA_ROOT=media
+        ):
+            url = render_shopping_list(user.pk, "txt")["url"]
+            job = Job.objects.get(name="images.delete_files")
+            self.assertGreater(job.run_at, timezone.now())
+            (name,) = job.payload["names"]
+            self.assertTrue(url.endswith(name))
+            self.assertTrue(default_storage.exists(name))
+            self.assertEqual(Job.objects.claim(10), [])
+
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+            self.assertEqual(Job.objects.claim(10), [job.pk])
+            self.assertTrue(run_job(job.pk))
+            self.assertFalse(default_storage.exists(name))
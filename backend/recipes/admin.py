@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag, TagRecipe
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, Tag, TagRecipe)
 
 
 class TagRecipeInline(admin.TabularInline):
@@ -21,9 +22,17 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ("tags",)
     readonly_fields = ("favorite_count_display", "short_link")
 
+    def save_related(self, request, form, formsets, change):
+        recipe_id = form.instance.id
+        before = IngredientRecipe.objects.amounts(recipe_id)
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.apply_recipe_change(
+            recipe_id, before, IngredientRecipe.objects.amounts(recipe_id)
+        )
+
     @admin.display(description="Добавили в Избранное")
     def favorite_count_display(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorites_count
 
 
 @admin.register(Tag)
@@ -1,7 +1,14 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "recipes"
     verbose_name = "Рецепты"
+
+    def ready(self):
+        import recipes.signals  # noqa: F401
+        from recipes.generations import check_generations_cache
+
+        checks.register(check_generations_cache)
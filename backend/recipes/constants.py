@@ -16,8 +16,20 @@ LENGTH_MESURE_UNIT = 64
 SHORT_LINK_LENGTH = 7
 """Длина для короткой ссылки на руцепт."""
 
+SHORT_CODE_LENGTH = 6
+"""Длина кода короткой ссылки, вычисляемого из id рецепта."""
+
 COOKING_TIME = 1
 """Время готовки не меньше 1 минуты."""
 
 MIN_AMOUNT = 1
 """Минимальное количество для ингредиента."""
+
+INGREDIENT_SEARCH_LIMIT = 50
+"""Сколько ингредиентов максимум отдавать в автодополнении."""
+
+FUZZY_THRESHOLD = 0.5
+"""Минимальная доля общих триграмм при нечетком поиске ингредиента."""
+
+SEARCH_CONFIG = "russian"
+"""Конфигурация полнотекстового поиска PostgreSQL для рецептов."""
@@ -0,0 +1,126 @@
+"""Поколения данных для сброса файлов, собранных в каждом процессе.
+
+Индекс ингредиентов и готовые ответы справочников собираются в
+локальные файлы и держатся в памяти воркеров. Сброс меняет поколение,
+а файл хранит поколение, для которого собран; файл другого поколения
+собирается заново.
+
+По умолчанию поколение лежит в файле каталога GENERATIONS_DIR: его
+видят все процессы хоста — воркеры gunicorn, воркер задач и команды
+manage.py, если каталог у них общий. Проверка стоит одного stat(), файл
+перечитывается, только когда его заменили. Если хостов несколько,
+GENERATIONS_CACHE задает общий кэш Django (Redis, Memcached), и
+поколение хранится в нем.
+
+Поколение читается до выборки из БД. Если данные сбросили во время
+сборки, поколение уже другое: такой файл не сохраняется и не затирает
+более новый.
+"""
+import os
+import tempfile
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Error
+
+# Кэши, которые не видны другим процессам.
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+class Generation:
+    """Поколение данных с именем name."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._read = None
+
+    @property
+    def path(self):
+        return os.path.join(settings.GENERATIONS_DIR, self.name)
+
+    def current(self):
+        """Текущее поколение; если его нет, создает новое."""
+        if settings.GENERATIONS_CACHE:
+            return self._current_in_cache()
+        return self._current_in_file()
+
+    def bump(self):
+        """Начинает новое поколение во всех процессах."""
+        if settings.GENERATIONS_CACHE:
+            caches[settings.GENERATIONS_CACHE].set(
+                f"generation:{self.name}", uuid.uuid4().hex, None
+            )
+        else:
+            os.replace(self._write(), self.path)
+
+    def _current_in_cache(self):
+        cache = caches[settings.GENERATIONS_CACHE]
+        key = f"generation:{self.name}"
+        generation = cache.get(key)
+        if generation is None:
+            cache.add(key, uuid.uuid4().hex, None)
+            generation = cache.get(key)
+        return generation
+
+    def _current_in_file(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            tmp_path = self._write()
+            try:
+                # link() не заменяет существующий файл: из нескольких
+                # процессов, создающих поколение, побеждает первый.
+                os.link(tmp_path, self.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+            stat = os.stat(self.path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+        read = self._read
+        if read is not None and read[0] == version:
+            return read[1]
+        with self._lock:
+            with open(self.path) as file:
+                generation = file.read()
+            self._read = (version, generation)
+        return generation
+
+    def _write(self):
+        os.makedirs(settings.GENERATIONS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=settings.GENERATIONS_DIR, suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as file:
+            file.write(uuid.uuid4().hex)
+        return tmp_path
+
+
+def check_generations_cache(app_configs, **kwargs):
+    """GENERATIONS_CACHE, не общий для процессов, не сбросит их файлы."""
+    alias = settings.GENERATIONS_CACHE
+    if alias and settings.CACHES[alias]["BACKEND"] in LOCAL_CACHE_BACKENDS:
+        return [
+            Error(
+                f"GENERATIONS_CACHE указывает на кэш {alias!r}, который "
+                "не виден другим процессам.",
+                hint=(
+                    "Укажите общий кэш (Redis, Memcached) или оставьте "
+                    "GENERATIONS_CACHE пустым, чтобы поколения хранились "
+                    "в GENERATIONS_DIR."
+                ),
+                id="recipes.E001",
+            )
+        ]
+    return []
+
+
+# Меняется при любом изменении рецептов, видном в списке: по нему
+# строится ETag списка рецептов без выборки из таблицы.
+recipes_generation = Generation("recipes")
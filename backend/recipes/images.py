@@ -0,0 +1,105 @@
+"""Уменьшенные копии изображений рецептов и аватаров.
+
+Для каждого загруженного файла сохраняются варианты из VARIANTS в WebP
+и JPEG рядом с оригиналом, в подкаталоге variants/, и строится
+крошечная размытая заглушка в виде data URI. EXIF в копии не попадает,
+ориентация со снимка применяется к пикселям заранее.
+
+Имена вариантов вычисляются из имени оригинала, поэтому для ссылок на
+них не нужно хранить ничего, кроме заглушки: пустая заглушка значит,
+что варианты еще не построены и отдавать нужно оригинал.
+"""
+import base64
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageFilter, ImageOps
+
+VARIANTS = {
+    "thumbnail": 160,
+    "card": 480,
+    "full": 1280,
+}
+FORMATS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {
+        "format": "JPEG",
+        "quality": 82,
+        "optimize": True,
+        "progressive": True,
+    },
+}
+PLACEHOLDER_SIZE = 16
+
+
+def variant_name(name, variant, extension):
+    directory, filename = os.path.split(name)
+    return os.path.join(
+        directory, "variants", f"{filename}.{variant}.{extension}"
+    )
+
+
+def variant_names(name):
+    return [
+        variant_name(name, variant, extension)
+        for variant in VARIANTS
+        for extension in FORMATS
+    ]
+
+
+def render_variants(storage, name):
+    """Сохраняет все варианты файла name и возвращает заглушку."""
+    with storage.open(name, "rb") as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert("RGB")
+
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for extension, options in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, **options)
+            target = variant_name(name, variant, extension)
+            storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+
+    placeholder = image.copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    placeholder = placeholder.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    placeholder.save(buffer, format="JPEG", quality=40)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f"data:image/jpeg;base64,{encoded}"
+
+
+def stored_names(name):
+    """Имена оригинала name и всех его вариантов в хранилище."""
+    return [name, *variant_names(name)]
+
+
+def variants_representation(file, placeholder):
+    """Ссылки на варианты для ответа API; без заглушки — на оригинал."""
+    if not file:
+        return None
+    if not placeholder:
+        original = f"{settings.BASE_URL}{file.url}"
+        return {
+            "placeholder": None,
+            **{
+                variant: {extension: original for extension in FORMATS}
+                for variant in VARIANTS
+            },
+        }
+    return {
+        "placeholder": placeholder,
+        **{
+            variant: {
+                extension: settings.BASE_URL
+                + file.storage.url(variant_name(file.name, variant, extension))
+                for extension in FORMATS
+            }
+            for variant in VARIANTS
+        },
+    }
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription
+
+User = get_user_model()
+
+
+def counted(model, field):
+    """Подзапрос с фактическим числом связанных строк."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+COUNTERS = (
+    (Recipe, "favorites_count", Favorite, "recipe"),
+    (Recipe, "in_carts_count", ShoppingCart, "recipe"),
+    (User, "recipes_count", Recipe, "author"),
+    (User, "subscribers_count", Subscription, "subscribed_to"),
+)
+
+
+class Command(BaseCommand):
+    help = "Detect and repair drift in denormalized counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только найти расхождения, не исправляя их.",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, related, related_field in COUNTERS:
+            actual = counted(related, related_field)
+            with transaction.atomic():
+                drifted = list(
+                    model.objects.select_for_update()
+                    .annotate(actual=actual)
+                    .filter(~Q(**{field: F("actual")}))
+                    .values_list("pk", flat=True)
+                )
+                if drifted and not options["check"]:
+                    model.objects.filter(pk__in=drifted).update(
+                        **{field: actual}
+                    )
+            total += len(drifted)
+            if drifted:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{model.__name__}.{field}: "
+                        f"расхождений {len(drifted)}."
+                    )
+                )
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS("Счетчики актуальны."))
+        elif options["check"]:
+            raise CommandError("Счетчики расходятся с данными.")
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(f"Исправлено счетчиков: {total}.")
+            )
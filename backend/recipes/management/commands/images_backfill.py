@@ -0,0 +1,91 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from recipes.images import render_variants
+from recipes.models import Recipe
+from recipes.signals import touch
+
+User = get_user_model()
+
+SOURCES = (
+    (Recipe, "image"),
+    (User, "avatar"),
+)
+
+
+def render(name):
+    """Выполняется в дочернем процессе: только работа с файлами."""
+    try:
+        return render_variants(default_storage, name)
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = "Build image variants and placeholders for existing images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Сколько процессов обрабатывают изображения.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Перестроить варианты и у изображений, где они уже есть.",
+        )
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers должен быть больше нуля.")
+
+        jobs = []
+        for model, field in SOURCES:
+            queryset = model.objects.exclude(**{field: ""}).exclude(
+                **{f"{field}__isnull": True}
+            )
+            if not options["force"]:
+                queryset = queryset.filter(**{f"{field}_placeholder": ""})
+            jobs += [
+                (model, field, pk, name)
+                for pk, name in queryset.values_list("pk", field)
+            ]
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS("Все варианты уже готовы."))
+            return
+
+        # Соединения с БД не должны наследоваться дочерними процессами.
+        connections.close_all()
+        with ProcessPoolExecutor(options["workers"]) as pool:
+            placeholders = list(
+                pool.map(render, [name for *_, name in jobs], chunksize=8)
+            )
+
+        failed = 0
+        for (model, field, pk, _), placeholder in zip(jobs, placeholders):
+            if placeholder is None:
+                failed += 1
+                continue
+            model.objects.filter(pk=pk).update(
+                **{f"{field}_placeholder": placeholder}
+            )
+            recipes = (
+                Recipe.objects.filter(pk=pk)
+                if model is Recipe
+                else Recipe.objects.filter(author_id=pk)
+            )
+            touch(recipes, "updated_at")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Изображений обработано: {len(jobs) - failed}, "
+                f"не удалось прочитать: {failed}."
+            )
+        )
@@ -1,35 +1,125 @@
 import csv
+import json
 import os
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from recipes.models import Ingredient
+from recipes.signals import ingredients_imported
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Потоково разбирает JSON-массив объектов, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer, position, started = "", 0, False
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != "[":
+                    raise CommandError("Ожидается JSON-массив ингредиентов.")
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError("Файл JSON оборван.")
+                break
+            yield item["name"], item["measurement_unit"]
+        if not chunk:
+            return
+
+
+READERS = {".csv": read_csv, ".json": read_json}
 
 
 class Command(BaseCommand):
-    help = "Import data from CSV file to Ingrediemt model"
+    help = "Import ingredients from a CSV or JSON file in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default=os.path.join(
+                settings.BASE_DIR.parent, "data", "ingredients.csv"
+            ),
+            help="Путь к ingredients.csv или ingredients.json.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Сколько строк вставлять одним запросом.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только посчитать, что будет добавлено, без записи в БД.",
+        )
 
     def handle(self, *args, **options):
-        base_parent_dir = os.path.abspath(
-            os.path.join(settings.BASE_DIR, os.pardir)
+        path = options["path"]
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError("Поддерживаются только файлы .csv и .json.")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size должен быть больше нуля.")
+
+        # Ключ тот же, что у ограничения unique_ingredient.
+        existing = set(
+            Ingredient.objects.values_list("name", "measurement_unit")
         )
-        ingredients = os.path.join(base_parent_dir, "data", "ingredients.csv")
-        with open(ingredients, encoding="utf-8") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                ingredient, created = Ingredient.objects.get_or_create(
-                    name=row[0], defaults={"measurement_unit": row[1]}
+        seen = set()
+        total = duplicates = new = 0
+        with transaction.atomic(), open(path, encoding="utf-8") as file:
+            batch = []
+            for name, measurement_unit in reader(file):
+                total += 1
+                key = (name.strip(), measurement_unit.strip())
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                if key in existing:
+                    continue
+                new += 1
+                batch.append(Ingredient(name=key[0], measurement_unit=key[1]))
+                if len(batch) >= options["batch_size"]:
+                    self.save(batch, options)
+                    batch = []
+            self.save(batch, options)
+            if new and not options["dry_run"]:
+                transaction.on_commit(
+                    lambda: ingredients_imported.send(sender=self.__class__)
                 )
-                if created:
-                    self.stdout.write(
-                        self.style.SUCCESS(f"Добавлен ингридиент {row[0]}")
-                    )
-                else:
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f"Ингридиент {row[0]} уже существует."
-                        )
-                    )
-
-        self.stdout.write(self.style.SUCCESS("Импорт завершон."))
+
+        status = "Будет добавлено" if options["dry_run"] else "Добавлено"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Прочитано строк: {total}, повторов в файле: {duplicates}, "
+                f"уже в базе: {len(seen) - new}. {status}: {new}."
+            )
+        )
+
+    def save(self, batch, options):
+        if batch and not options["dry_run"]:
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
@@ -0,0 +1,457 @@
+import io
+import itertools
+import random
+import time
+from bisect import bisect
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag, TagRecipe,
+                            TimelineEntry)
+from recipes.shortlinks import encode
+from users.models import Subscription
+
+User = get_user_model()
+
+PASSWORD = "seed-password"
+ZIPF_EXPONENT = 1.1
+CELEBRITY_WEIGHT = 200
+CELEBRITY_FOLLOW_SHARE = 0.3
+TAGS = (
+    ("Завтрак", "breakfast"),
+    ("Обед", "lunch"),
+    ("Ужин", "dinner"),
+    ("Десерт", "dessert"),
+    ("Выпечка", "baking"),
+    ("Суп", "soup"),
+    ("Салат", "salad"),
+    ("Вегетарианское", "vegetarian"),
+)
+FIRST_NAMES = (
+    "Анна Мария Елена Ольга Татьяна Иван Алексей "
+    "Дмитрий Сергей Андрей Наталья Павел Юлия Олег"
+).split()
+LAST_NAMES = (
+    "Иванова Смирнов Кузнецова Попов Соколова Лебедев "
+    "Козлова Новиков Морозова Петров Волкова Федоров"
+).split()
+DISHES = (
+    "суп салат пирог омлет рагу плов запеканка "
+    "паста котлеты блины каша сырники борщ жаркое"
+).split()
+ADJECTIVES = (
+    "Домашний Быстрый Летний Пряный Сливочный Бабушкин "
+    "Легкий Сытный Постный Праздничный Острый Нежный"
+).split()
+
+
+def zipf_weights(rng, size, exponent=ZIPF_EXPONENT):
+    """Веса по закону Ципфа, случайно распределенные между объектами."""
+    weights = [1 / rank**exponent for rank in range(1, size + 1)]
+    rng.shuffle(weights)
+    return weights
+
+
+def sample(rng, cum_weights, count, exclude=()):
+    """count различных индексов с вероятностью по накопленным весам."""
+    chosen = set()
+    total = cum_weights[-1]
+    limit = len(cum_weights) - len(exclude)
+    count = min(count, limit)
+    while len(chosen) < count:
+        index = bisect(cum_weights, rng.random() * total)
+        if index not in exclude:
+            chosen.add(index)
+    return chosen
+
+
+def heavy_tail(rng, mean, limit):
+    """Число действий пользователя: у большинства мало, у немногих много."""
+    return min(limit, int(rng.expovariate(1 / mean))) if mean else 0
+
+
+@contextmanager
+def explicit_dates(model, *names):
+    """Отключает auto_now у полей, чтобы bulk_create записал свои даты."""
+    fields = [model._meta.get_field(name) for name in names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = "Generate a reproducible production-scale synthetic dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users", type=int, default=10000, help="Число пользователей."
+        )
+        parser.add_argument(
+            "--recipes", type=int, default=50000, help="Число рецептов."
+        )
+        parser.add_argument(
+            "--celebrities",
+            type=int,
+            default=5,
+            help="Сколько авторов получат огромное число подписчиков.",
+        )
+        parser.add_argument(
+            "--favorites",
+            type=float,
+            default=30,
+            help="Среднее число рецептов в избранном у пользователя.",
+        )
+        parser.add_argument(
+            "--carts",
+            type=float,
+            default=3,
+            help="Среднее число рецептов в корзине у пользователя.",
+        )
+        parser.add_argument(
+            "--subscriptions",
+            type=float,
+            default=20,
+            help="Среднее число подписок пользователя (без знаменитостей).",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=365,
+            help="За сколько дней распределить даты публикации.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=1,
+            help="Зерно генератора: одно зерно дает одни и те же данные.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Сколько строк вставлять одним запросом.",
+        )
+
+    def handle(self, *args, **options):
+        for name in ("users", "recipes", "batch_size", "days"):
+            if options[name] < 1:
+                raise CommandError(
+                    f"--{name.replace('_', '-')} должен быть больше нуля."
+                )
+        if not 0 <= options["celebrities"] <= options["users"]:
+            raise CommandError("--celebrities не больше числа пользователей.")
+        ingredient_ids = list(
+            Ingredient.objects.order_by("id").values_list("id", flat=True)
+        )
+        if not ingredient_ids:
+            raise CommandError(
+                "В базе нет ингредиентов: выполните ingredients_import."
+            )
+        self.prefix = f"seed{options['seed']}_"
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f"Данные с зерном {options['seed']} уже созданы."
+            )
+
+        started = time.perf_counter()
+        self.rng = random.Random(options["seed"])
+        self.options = options
+        with transaction.atomic():
+            tag_ids = self.tags()
+            counts = self.generate(ingredient_ids, tag_ids)
+            self.reset_sequences()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Создано: "
+                + ", ".join(f"{name} {count}" for name, count in counts)
+                + f". Заняло {time.perf_counter() - started:.1f} с."
+            )
+        )
+
+    def tags(self):
+        for name, slug in TAGS:
+            Tag.objects.get_or_create(slug=slug, defaults={"name": name})
+        return list(Tag.objects.order_by("id").values_list("id", flat=True))
+
+    def image(self):
+        """Одна картинка на все рецепты, чтобы ссылки не вели в 404."""
+        name = f"recipes/images/{self.prefix}dish.jpg"
+        if not default_storage.exists(name):
+            buffer = io.BytesIO()
+            Image.new("RGB", (640, 480), (214, 140, 69)).save(
+                buffer, format="JPEG"
+            )
+            name = default_storage.save(name, ContentFile(buffer.getvalue()))
+        return name
+
+    def generate(self, ingredient_ids, tag_ids):
+        rng, options = self.rng, self.options
+        user_count, recipe_count = options["users"], options["recipes"]
+        first_user = (User.objects.aggregate(top=Max("id"))["top"] or 0) + 1
+        first_recipe = (
+            Recipe.objects.aggregate(top=Max("id"))["top"] or 0
+        ) + 1
+
+        # Популярность авторов: степенной закон и несколько знаменитостей.
+        popularity = zipf_weights(rng, user_count)
+        celebrities = set(
+            rng.sample(range(user_count), options["celebrities"])
+        )
+        for index in celebrities:
+            popularity[index] = CELEBRITY_WEIGHT
+        author_weights = list(itertools.accumulate(popularity))
+
+        authors = [
+            bisect(author_weights, rng.random() * author_weights[-1])
+            for _ in range(recipe_count)
+        ]
+        recipe_popularity = [
+            popularity[author] * weight
+            for author, weight in zip(authors, zipf_weights(rng, recipe_count))
+        ]
+        recipe_weights = list(itertools.accumulate(recipe_popularity))
+        ingredient_weights = list(
+            itertools.accumulate(zipf_weights(rng, len(ingredient_ids)))
+        )
+        tag_weights = list(
+            itertools.accumulate(zipf_weights(rng, len(tag_ids), 0.7))
+        )
+
+        recipe_ingredients = [
+            {
+                ingredient_ids[index]: rng.randint(1, 500)
+                for index in sample(
+                    rng, ingredient_weights, rng.randint(3, 12)
+                )
+            }
+            for _ in range(recipe_count)
+        ]
+        recipe_tags = [
+            [
+                tag_ids[index]
+                for index in sample(rng, tag_weights, rng.randint(1, 3))
+            ]
+            for _ in range(recipe_count)
+        ]
+
+        subscriptions, favorites, carts = [], [], []
+        for user in range(user_count):
+            followed = sample(
+                rng,
+                author_weights,
+                heavy_tail(rng, options["subscriptions"], user_count // 2),
+                exclude={user},
+            )
+            followed |= {
+                celebrity
+                for celebrity in celebrities
+                if celebrity != user and rng.random() < CELEBRITY_FOLLOW_SHARE
+            }
+            subscriptions += [(user, author) for author in followed]
+            favorites += [
+                (user, recipe)
+                for recipe in sample(
+                    rng,
+                    recipe_weights,
+                    heavy_tail(rng, options["favorites"], recipe_count),
+                )
+            ]
+            carts += [
+                (user, recipe)
+                for recipe in sample(
+                    rng,
+                    recipe_weights,
+                    heavy_tail(rng, options["carts"], recipe_count),
+                )
+            ]
+
+        recipes_count = Counter(authors)
+        subscribers_count = Counter(author for _, author in subscriptions)
+        favorites_count = Counter(recipe for _, recipe in favorites)
+        carts_count = Counter(recipe for _, recipe in carts)
+
+        password = make_password(PASSWORD)
+        self.insert(
+            User,
+            (
+                User(
+                    id=first_user + index,
+                    username=f"{self.prefix}{index}",
+                    email=f"{self.prefix}{index}@example.com",
+                    first_name=rng.choice(FIRST_NAMES),
+                    last_name=rng.choice(LAST_NAMES),
+                    password=password,
+                    recipes_count=recipes_count[index],
+                    subscribers_count=subscribers_count[index],
+                )
+                for index in range(user_count)
+            ),
+        )
+
+        # Даты растут вместе с id, как у рецептов, созданных через API.
+        now = timezone.now()
+        span = options["days"] * 24 * 3600
+        offsets = sorted(
+            (rng.randrange(span) for _ in range(recipe_count)), reverse=True
+        )
+        image = self.image()
+        with explicit_dates(Recipe, "pub_date", "updated_at"):
+            self.insert(
+                Recipe,
+                (
+                    Recipe(
+                        id=first_recipe + index,
+                        author_id=first_user + authors[index],
+                        name=f"{rng.choice(ADJECTIVES)} {rng.choice(DISHES)}",
+                        text="Сгенерированный рецепт для нагрузочных тестов.",
+                        image=image,
+                        cooking_time=max(1, int(rng.lognormvariate(3.3, 0.6))),
+                        pub_date=now - timedelta(seconds=offsets[index]),
+                        updated_at=now - timedelta(seconds=offsets[index]),
+                        short_link=encode(first_recipe + index),
+                        favorites_count=favorites_count[index],
+                        in_carts_count=carts_count[index],
+                    )
+                    for index in range(recipe_count)
+                ),
+            )
+
+        self.insert(
+            IngredientRecipe,
+            (
+                IngredientRecipe(
+                    recipe_id=first_recipe + index,
+                    ingredient_id=ingredient_id,
+                    amount=amount,
+                )
+                for index, amounts in enumerate(recipe_ingredients)
+                for ingredient_id, amount in amounts.items()
+            ),
+        )
+        self.insert(
+            TagRecipe,
+            (
+                TagRecipe(recipe_id=first_recipe + index, tag_id=tag_id)
+                for index, tags in enumerate(recipe_tags)
+                for tag_id in tags
+            ),
+        )
+        self.insert(
+            Subscription,
+            (
+                Subscription(
+                    user_id=first_user + user,
+                    subscribed_to_id=first_user + author,
+                )
+                for user, author in subscriptions
+            ),
+        )
+
+        # Ленты заполняет задача feed.fan_out; авторов с числом подписчиков
+        # от FEED_CELEBRITY_THRESHOLD лента подмешивает при чтении. Как и
+        # при подписке, в ленту попадают только последние
+        # FEED_BACKFILL_LIMIT рецептов каждого автора.
+        author_recipes = defaultdict(list)
+        for index, author in enumerate(authors):
+            author_recipes[author].append(index)
+        for author, indexes in author_recipes.items():
+            indexes.sort(key=lambda index: (offsets[index], -index))
+            del indexes[settings.FEED_BACKFILL_LIMIT:]
+        timeline = [
+            (user, author)
+            for user, author in subscriptions
+            if subscribers_count[author] < settings.FEED_CELEBRITY_THRESHOLD
+        ]
+        self.insert(
+            TimelineEntry,
+            (
+                TimelineEntry(
+                    user_id=first_user + user,
+                    recipe_id=first_recipe + index,
+                    author_id=first_user + author,
+                    pub_date=now - timedelta(seconds=offsets[index]),
+                )
+                for user, author in timeline
+                for index in author_recipes[author]
+            ),
+        )
+        for model, pairs in ((Favorite, favorites), (ShoppingCart, carts)):
+            self.insert(
+                model,
+                (
+                    model(
+                        user_id=first_user + user,
+                        recipe_id=first_recipe + recipe,
+                    )
+                    for user, recipe in pairs
+                ),
+            )
+
+        # Сводные списки покупок ведут сигналы, а bulk_create их не шлет.
+        shopping_list = defaultdict(int)
+        for user, recipe in carts:
+            for ingredient_id, amount in recipe_ingredients[recipe].items():
+                shopping_list[user, ingredient_id] += amount
+        self.insert(
+            ShoppingListItem,
+            (
+                ShoppingListItem(
+                    user_id=first_user + user,
+                    ingredient_id=ingredient_id,
+                    amount=amount,
+                )
+                for (user, ingredient_id), amount in shopping_list.items()
+            ),
+        )
+
+        return (
+            ("пользователей", user_count),
+            ("рецептов", recipe_count),
+            ("ингредиентов в рецептах", sum(map(len, recipe_ingredients))),
+            ("тегов в рецептах", sum(map(len, recipe_tags))),
+            ("подписок", len(subscriptions)),
+            (
+                "записей лент",
+                sum(len(author_recipes[author]) for _, author in timeline),
+            ),
+            ("избранного", len(favorites)),
+            ("в корзинах", len(carts)),
+            ("позиций списков покупок", len(shopping_list)),
+        )
+
+    def insert(self, model, objects):
+        batch_size = self.options["batch_size"]
+        while True:
+            batch = list(itertools.islice(objects, batch_size))
+            if not batch:
+                return
+            model.objects.bulk_create(batch, batch_size=batch_size)
+
+    @staticmethod
+    def reset_sequences():
+        """После вставки с явными id сдвигает последовательности PostgreSQL."""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Recipe]
+            ):
+                cursor.execute(sql)
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = "Check and rebuild aggregated shopping lists from carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сверить со списками из корзин, не перестраивая.",
+        )
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="user_ids",
+            help="Ограничить пользователем с указанным id.",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options["user_ids"]
+        stored = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in stored.values_list(
+                "user_id", "ingredient_id", "amount"
+            )
+        }
+        live = ShoppingListItem.objects.live(user_ids)
+
+        drift = {
+            key
+            for key in stored.keys() | live.keys()
+            if stored.get(key) != live.get(key)
+        }
+        if not drift:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Списки покупок актуальны: {len(live)} позиций."
+                )
+            )
+            return
+
+        self.stdout.write(
+            self.style.WARNING(f"Расхождений в списках покупок: {len(drift)}.")
+        )
+        if options["check"]:
+            raise CommandError("Списки покупок не совпадают с корзинами.")
+
+        count = ShoppingListItem.objects.rebuild(user_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f"Списки покупок перестроены: {count} позиций.")
+        )
@@ -0,0 +1,74 @@
+import itertools
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models.functions import Length
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from api.views import ReturnShortLinkRecipeAPI
+from recipes.constants import SHORT_LINK_LENGTH
+from recipes.models import Recipe
+from recipes.shortlinks import encode
+
+SAMPLE_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Measure short link redirect throughput for old and new links"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=5000,
+            help="Сколько переходов выполнить для каждого вида ссылок.",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests должен быть больше нуля.")
+        ids = list(Recipe.objects.values_list("id", flat=True)[:SAMPLE_SIZE])
+        if not ids:
+            raise CommandError("В базе нет рецептов.")
+        legacy = list(
+            Recipe.objects.annotate(length=Length("short_link"))
+            .filter(length=SHORT_LINK_LENGTH)
+            .values_list("short_link", flat=True)[:SAMPLE_SIZE]
+        )
+
+        if legacy:
+            self.report("Старые ссылки (поиск в БД)", legacy, options)
+        else:
+            self.stdout.write("Старых ссылок в базе нет, замер пропущен.")
+        self.report(
+            "Новые ссылки (без БД)", [encode(pk) for pk in ids], options
+        )
+
+    def report(self, title, codes, options):
+        view = ReturnShortLinkRecipeAPI.as_view()
+        factory = RequestFactory()
+        requests = [
+            (factory.get(f"/s/{code}/"), code)
+            for code in itertools.islice(
+                itertools.cycle(codes), options["requests"]
+            )
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for request, code in requests:
+                response = view(request, short_link=code)
+                if response.status_code != 302:
+                    raise CommandError(
+                        f"/s/{code}/ вернул {response.status_code}."
+                    )
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{title}: {len(requests) / elapsed:.0f} переходов/с, "
+                f"{elapsed / len(requests) * 1e6:.1f} мкс на переход, "
+                f"запросов к БД: {len(queries)}."
+            )
+        )
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:44
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+CREATE_TRIGGER = """
+CREATE FUNCTION recipes_recipe_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A')
+        || setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector_update();
+
+UPDATE recipes_recipe SET search_vector = NULL;
+
+CREATE INDEX recipes_recipe_search_vector_gin
+    ON recipes_recipe USING gin (search_vector);
+"""
+
+DROP_TRIGGER = """
+DROP INDEX IF EXISTS recipes_recipe_search_vector_gin;
+DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger ON recipes_recipe;
+DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update();
+"""
+
+
+def run_on_postgresql(sql):
+    """Триггер и GIN-индекс есть только в PostgreSQL; SQLite пропускаем."""
+
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            run_on_postgresql(CREATE_TRIGGER),
+            run_on_postgresql(DROP_TRIGGER),
+        ),
+    ]
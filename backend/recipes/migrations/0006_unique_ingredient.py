@@ -0,0 +1,73 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:45
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_rows(model, owner, keep, duplicates):
+    """Переводит строки model на ингредиент keep, складывая количества.
+
+    У IngredientRecipe и ShoppingListItem пара (владелец, ингредиент)
+    уникальна, поэтому строки одного владельца сливаются в одну.
+    """
+    rows = defaultdict(list)
+    for row in model.objects.filter(
+        ingredient_id__in=[keep, *duplicates]
+    ).order_by('id'):
+        rows[getattr(row, f'{owner}_id')].append(row)
+    for group in rows.values():
+        target = next(
+            (row for row in group if row.ingredient_id == keep), group[0]
+        )
+        others = [row.pk for row in group if row is not target]
+        if not others and target.ingredient_id == keep:
+            continue
+        model.objects.filter(pk__in=others).delete()
+        target.amount = sum(row.amount for row in group)
+        target.ingredient_id = keep
+        target.save()
+
+
+def merge_duplicates(apps, schema_editor):
+    """Сливает ингредиенты с одинаковыми (name, measurement_unit).
+
+    Остается строка с наименьшим id; рецепты и списки покупок
+    переводятся на нее до того, как появится ограничение уникальности.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    groups = (
+        Ingredient.objects.values('name', 'measurement_unit')
+        .annotate(total=Count('id'), keep=Min('id'))
+        .filter(total__gt=1)
+    )
+    for group in groups:
+        duplicates = list(
+            Ingredient.objects.filter(
+                name=group['name'],
+                measurement_unit=group['measurement_unit'],
+            )
+            .exclude(pk=group['keep'])
+            .values_list('id', flat=True)
+        )
+        merge_rows(IngredientRecipe, 'recipe', group['keep'], duplicates)
+        merge_rows(ShoppingListItem, 'user', group['keep'], duplicates)
+        Ingredient.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
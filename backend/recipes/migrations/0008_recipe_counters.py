@@ -0,0 +1,47 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:48
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def counted(model, field):
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(**{field: models.OuterRef('pk')})
+            .values(field)
+            .annotate(total=models.Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    Recipe.objects.update(
+        favorites_count=counted(Favorite, 'recipe'),
+        in_carts_count=counted(ShoppingCart, 'recipe'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавили в Избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавили в список покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-18 07:10
+
+from django.db import migrations
+
+TRIGGER = """
+DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger ON recipes_recipe;
+CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE{columns} ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector_update();
+"""
+
+
+def run_on_postgresql(sql):
+    """Триггер есть только в PostgreSQL; SQLite пропускаем."""
+
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(sql)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+    """Вектор пересчитывается только при изменении названия или описания.
+
+    Обновления счетчиков, updated_at, short_link и заглушек больше не
+    вызывают to_tsvector.
+    """
+
+    dependencies = [
+        ('recipes', '0012_timelineentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_on_postgresql(TRIGGER.format(columns=' OF name, text')),
+            run_on_postgresql(TRIGGER.format(columns='')),
+        ),
+    ]
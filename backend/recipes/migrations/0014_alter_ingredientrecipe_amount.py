@@ -0,0 +1,21 @@
+# Generated by Django 3.2.3 on 2026-10-18 07:30
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Догоняет модель: amount уже был PositiveSmallIntegerField с
+    MinValueValidator(1), но миграции этого не отражали."""
+
+    dependencies = [
+        ('recipes', '0013_search_vector_trigger_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ingredientrecipe',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Количество'),
+        ),
+    ]
@@ -1,19 +1,64 @@
-import uuid
+from collections import defaultdict
+from itertools import islice
 
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import Greatest, RowNumber
 
 from recipes.constants import (COOKING_TIME, LENGTH_INGREDIENT,
                                LENGTH_MESURE_UNIT, LENGTH_TAG,
                                LENGTH_TO_DISPLAY, MIN_AMOUNT,
                                RECIPE_NAME_LENGTH, SHORT_LINK_LENGTH)
+from recipes.shortlinks import encode
 from recipes.validators import validate_slug
+from users.models import PreservedFieldsMixin, Subscription
 
 User = get_user_model()
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    def latest_by_author(self, author_ids, limit=None):
+        """Последние limit рецептов каждого автора одним запросом.
+
+        Номер рецепта у автора считается оконной функцией ROW_NUMBER(),
+        поэтому объем выборки не зависит от того, сколько всего рецептов
+        у авторов.
+        """
+        recipes = self.filter(author_id__in=author_ids)
+        if limit is not None:
+            ranked = (
+                recipes.annotate(
+                    author_rank=Window(
+                        RowNumber(),
+                        partition_by=[models.F("author_id")],
+                        order_by=[
+                            models.F("pub_date").desc(),
+                            models.F("id").desc(),
+                        ],
+                    )
+                )
+                .order_by()
+                .values("id", "author_rank")
+            )
+            sql, params = ranked.query.sql_with_params()
+            recipes = self.filter(
+                id__in=RawSQL(
+                    f"SELECT ranked.id FROM ({sql}) ranked "
+                    "WHERE ranked.author_rank <= %s",
+                    (*params, limit),
+                )
+            )
+
+        by_author = defaultdict(list)
+        for recipe in recipes.order_by("-pub_date", "-id"):
+            by_author[recipe.author_id].append(recipe)
+        return by_author
+
+
+class Recipe(PreservedFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -24,6 +69,9 @@ class Recipe(models.Model):
     image = models.ImageField(
         upload_to="recipes/images/", verbose_name="Картинка"
     )
+    image_placeholder = models.TextField(
+        "Заглушка картинки", blank=True, editable=False
+    )
     text = models.TextField("Описание")
     ingredients = models.ManyToManyField(
         "Ingredient",
@@ -40,23 +88,46 @@ class Recipe(models.Model):
         validators=[MinValueValidator(COOKING_TIME)],
     )
     pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    updated_at = models.DateTimeField(
+        "Дата изменения", auto_now=True, db_index=True
+    )
     short_link = models.CharField(
         "Короткая ссылка",
         max_length=SHORT_LINK_LENGTH,
         unique=True,
         blank=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        "Добавили в Избранное", default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        "Добавили в список покупок", default=0, editable=False
+    )
+    search_vector = SearchVectorField(
+        "Поисковый вектор", null=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    preserved_fields = ("favorites_count", "in_carts_count")
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"], name="recipe_pub_date_id_idx"
+            )
+        ]
 
     def save(self, *args, **kwargs):
-        """Генерирует уникальную короткую ссылку на рецепт."""
-        if not self.short_link:
-            self.short_link = str(uuid.uuid4())[:SHORT_LINK_LENGTH]
+        """Записывает короткую ссылку, вычисленную из id рецепта."""
         super().save(*args, **kwargs)
+        if not self.short_link:
+            self.short_link = encode(self.pk)
+            Recipe.objects.filter(pk=self.pk).update(
+                short_link=self.short_link
+            )
 
     def __str__(self):
         return self.name[:LENGTH_TO_DISPLAY]
@@ -85,6 +156,11 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "measurement_unit"], name="unique_ingredient"
+            )
+        ]
 
     def __str__(self):
         return self.name[:LENGTH_TO_DISPLAY]
@@ -112,11 +188,26 @@ class TagRecipe(models.Model):
                 fields=["recipe", "tag"], name="unique_recipe_tag"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["tag", "recipe"], name="tagrecipe_tag_recipe_idx"
+            )
+        ]
 
     def __str__(self):
         return f"{self.recipe} {self.tag}"
 
 
+class IngredientRecipeQuerySet(models.QuerySet):
+    def amounts(self, recipe_id):
+        """Количество каждого ингредиента в рецепте."""
+        return dict(
+            self.filter(recipe_id=recipe_id).values_list(
+                "ingredient_id", "amount"
+            )
+        )
+
+
 class IngredientRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -135,6 +226,8 @@ class IngredientRecipe(models.Model):
         validators=[MinValueValidator(MIN_AMOUNT)],
     )
 
+    objects = IngredientRecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
@@ -201,3 +294,272 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f"{self.user} {self.recipe}"
+
+
+class ShoppingListQuerySet(models.QuerySet):
+    """Поддержка сводного списка покупок в актуальном состоянии."""
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет {ingredient_id: количество} к спискам пользователей.
+
+        Недостающие позиции вставляются с нулем через ignore_conflicts, и
+        затем все позиции меняются одним UPDATE с F(): параллельные
+        изменения того же списка складываются, а не падают на
+        уникальности. Позиции, ушедшие в ноль, удаляются.
+        """
+        deltas = {key: value for key, value in deltas.items() if value}
+        user_ids = set(user_ids)
+        if not user_ids or not deltas:
+            return
+
+        with transaction.atomic(savepoint=False):
+            self.bulk_create(
+                [
+                    self.model(
+                        user_id=user_id, ingredient_id=ingredient_id, amount=0
+                    )
+                    for user_id in user_ids
+                    for ingredient_id, delta in deltas.items()
+                    if delta > 0
+                ],
+                ignore_conflicts=True,
+            )
+            items = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+            items.update(
+                amount=Greatest(
+                    models.F("amount")
+                    + models.Case(
+                        *(
+                            models.When(
+                                ingredient_id=ingredient_id, then=delta
+                            )
+                            for ingredient_id, delta in deltas.items()
+                        ),
+                        output_field=models.IntegerField(),
+                    ),
+                    0,
+                )
+            )
+            if any(delta < 0 for delta in deltas.values()):
+                items.filter(amount=0).delete()
+
+    def apply_recipe_change(self, recipe_id, before, after):
+        """Переносит изменение ингредиентов рецепта в списки покупок."""
+        deltas = {
+            ingredient_id: after.get(ingredient_id, 0)
+            - before.get(ingredient_id, 0)
+            for ingredient_id in before.keys() | after.keys()
+        }
+        if not any(deltas.values()):
+            return
+        user_ids = ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list("user_id", flat=True)
+        self.apply_deltas(user_ids, deltas)
+
+    def for_download(self, user_id):
+        """Строки списка покупок пользователя для выгрузки в файл."""
+        return list(
+            self.filter(user_id=user_id)
+            .values(
+                name=models.F("ingredient__name"),
+                measurement_unit=models.F("ingredient__measurement_unit"),
+            )
+            .annotate(total_amount=models.Sum("amount"))
+            .order_by("name", "measurement_unit")
+        )
+
+    def live(self, user_ids=None):
+        """Суммы по корзинам, посчитанные напрямую через join."""
+        ingredients = IngredientRecipe.objects.all()
+        if user_ids is not None:
+            ingredients = ingredients.filter(
+                recipe__cart_users__user_id__in=user_ids
+            )
+        return {
+            (row["user_id"], row["ingredient_id"]): row["total_amount"]
+            for row in ingredients.values(
+                "ingredient_id", user_id=models.F("recipe__cart_users__user")
+            )
+            .exclude(user_id=None)
+            .annotate(total_amount=models.Sum("amount"))
+        }
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает сводные списки покупок с нуля."""
+        live = self.live(user_ids)
+        with transaction.atomic():
+            stale = self.all()
+            if user_ids is not None:
+                stale = stale.filter(user_id__in=user_ids)
+            stale.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    )
+                    for (user_id, ingredient_id), amount in live.items()
+                ),
+                batch_size=1000,
+            )
+        return len(live)
+
+
+class ShoppingListItem(models.Model):
+    """Сводная позиция списка покупок, обновляемая при изменении корзины."""
+
+    user = models.ForeignKey(
+        User,
+        related_name="shopping_list",
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name="in_shopping_lists",
+        on_delete=models.CASCADE,
+        verbose_name="Ингредиент",
+    )
+    amount = models.PositiveIntegerField("Количество")
+
+    objects = ShoppingListQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Позиция списка покупок"
+        verbose_name_plural = "Позиции списка покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"], name="unique_shopping_list_item"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.ingredient} {self.amount}"
+
+
+class TimelineQuerySet(models.QuerySet):
+    """Запись рецептов в ленты подписчиков."""
+
+    def deliver(self, recipe, user_ids, batch_size):
+        """Добавляет рецепт в ленты user_ids пачками по batch_size.
+
+        Каждая пачка вставляется одним INSERT ... SELECT, соединенным с
+        подписками на автора: кто отписался после того, как задача
+        прочитала user_ids, записи не получит. В PostgreSQL строки
+        подписок блокируются FOR SHARE, и отписка, которая чистит ленту,
+        дождется конца вставки. Повторная доставка ничего не меняет:
+        конфликты по (user, recipe) пропускаются, поэтому упавшую задачу
+        можно просто перезапустить.
+        """
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        columns = ", ".join(
+            quote(self.model._meta.get_field(name).column)
+            for name in ("user", "recipe", "author", "pub_date")
+        )
+        insert = "{} {} ({})".format(
+            connection.ops.insert_statement(ignore_conflicts=True),
+            quote(self.model._meta.db_table),
+            columns,
+        )
+        lock = ""
+        if connection.vendor == "postgresql":
+            lock = f" FOR SHARE OF {quote(Subscription._meta.db_table)}"
+        on_conflict = connection.ops.ignore_conflicts_suffix_sql(
+            ignore_conflicts=True
+        )
+        user_ids = iter(user_ids)
+        delivered = 0
+        with connection.cursor() as cursor:
+            while True:
+                batch = list(islice(user_ids, batch_size))
+                if not batch:
+                    return delivered
+                select, params = (
+                    Subscription.objects.filter(
+                        subscribed_to__recipes=recipe.pk, user_id__in=batch
+                    )
+                    .order_by()
+                    .values_list(
+                        "user_id",
+                        "subscribed_to__recipes__id",
+                        "subscribed_to_id",
+                        "subscribed_to__recipes__pub_date",
+                    )
+                    .query.get_compiler(self.db)
+                    .as_sql()
+                )
+                cursor.execute(
+                    f"{insert} {select}{lock} {on_conflict}", params
+                )
+                delivered += cursor.rowcount
+
+    def backfill(self, user_id, author_id, limit):
+        """Добавляет в ленту последние limit рецептов автора."""
+        recipes = Recipe.objects.filter(author_id=author_id).order_by(
+            "-pub_date", "-id"
+        )[:limit]
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, pub_date in recipes.values_list(
+                    "id", "pub_date"
+                )
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписчика его автора.
+
+    Автор и дата публикации скопированы из рецепта: страница ленты
+    читается по индексу (user, -pub_date, -recipe) без соединений.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name="timeline",
+        on_delete=models.CASCADE,
+        verbose_name="Пользователь",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name="timeline_entries",
+        on_delete=models.CASCADE,
+        verbose_name="Рецепт",
+    )
+    author = models.ForeignKey(
+        User,
+        related_name="+",
+        on_delete=models.CASCADE,
+        verbose_name="Автор",
+    )
+    pub_date = models.DateTimeField("Дата публикации")
+
+    objects = TimelineQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="unique_timeline_entry"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-recipe"],
+                name="timeline_user_pub_date_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.recipe}"
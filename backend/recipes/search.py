@@ -0,0 +1,290 @@
+"""Индекс названий ингредиентов для автодополнения без запросов к БД.
+
+Индекс хранится в файле и читается через mmap, поэтому форкнутые воркеры
+gunicorn делят одни и те же страницы page cache. Формат файла:
+
+    заголовок  =4sI32s  магическая строка, число записей и поколение
+    смещения   =I * n   начало каждой записи относительно блока данных
+    данные              записи, отсортированные по ключу
+
+Запись: ``ключ \\x1f id \\x1f название \\x1f единица \\n``, где ключ —
+название после normalize(). UTF-8 сохраняет порядок кодовых точек,
+поэтому двоичный поиск по байтам ключей совпадает с сортировкой строк.
+"""
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from recipes.constants import FUZZY_THRESHOLD, INGREDIENT_SEARCH_LIMIT
+from recipes.generations import Generation
+
+MAGIC = b"FGI2"
+HEADER = struct.Struct("=4sI32s")
+OFFSET = struct.Struct("=I")
+SEPARATOR = b"\x1f"
+
+
+LATIN_LAYOUT = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+CYRILLIC_LAYOUT = "йцукенгшщзхъфывапролджэячсмитьбюё"
+TO_CYRILLIC = str.maketrans(LATIN_LAYOUT, CYRILLIC_LAYOUT)
+TO_LATIN = str.maketrans(CYRILLIC_LAYOUT, LATIN_LAYOUT)
+
+
+def normalize(value):
+    """Ключ для сравнения названий."""
+    return " ".join(value.lower().replace("ё", "е").split())
+
+
+def layout_variants(query):
+    """Запрос как есть и набранный в другой раскладке клавиатуры."""
+    variants = [query]
+    for table in (TO_CYRILLIC, TO_LATIN):
+        switched = normalize(query.translate(table))
+        if switched not in variants:
+            variants.append(switched)
+    return variants
+
+
+def trigrams(value, partial=False):
+    """Триграммы слов; у последнего слова запроса конец не фиксируется."""
+    words = value.split()
+    grams = set()
+    for number, word in enumerate(words):
+        padded = f"  {word}"
+        if not (partial and number == len(words) - 1):
+            padded += " "
+        grams.update(
+            padded[index:index + 3] for index in range(len(padded) - 2)
+        )
+    return grams
+
+
+class _Keys:
+    """Последовательность ключей записей для модуля bisect."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __getitem__(self, position):
+        return self.snapshot.key(position)
+
+
+class _TrigramIndex:
+    """Обратный индекс триграмм для нечеткого поиска.
+
+    Строится в памяти процесса по записям снимка при первом нечетком
+    запросе и живет, пока жив снимок.
+    """
+
+    def __init__(self, snapshot):
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for position in range(len(snapshot)):
+            grams = trigrams(snapshot.key(position).decode())
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(position)
+
+    def search(self, query, limit, threshold):
+        """Записи, покрывающие не меньше threshold триграмм запроса."""
+        grams = trigrams(query, partial=True)
+        if not grams:
+            return []
+        common = defaultdict(int)
+        for gram in grams:
+            for position in self.postings.get(gram, ()):
+                common[position] += 1
+
+        minimum = threshold * len(grams)
+        ranked = [
+            (
+                -count / len(grams),
+                -2 * count / (len(grams) + self.sizes[position]),
+                position,
+            )
+            for position, count in common.items()
+            if count >= minimum
+        ]
+        return heapq.nsmallest(limit, ranked)
+
+
+class _Snapshot:
+    """Одна версия файла индекса, отображенная в память."""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Неизвестный формат индекса: {path}")
+        _, count, generation = HEADER.unpack_from(self.mm)
+        self.generation = generation.decode()
+        self.data_start = HEADER.size + OFFSET.size * count
+        table = memoryview(self.mm)[HEADER.size:self.data_start]
+        self.offsets = table.cast(OFFSET.format[-1])
+        self._trigrams = None
+
+    @property
+    def trigrams(self):
+        if self._trigrams is None:
+            self._trigrams = _TrigramIndex(self)
+        return self._trigrams
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def bounds(self, position):
+        start = self.data_start + self.offsets[position]
+        if position + 1 < len(self.offsets):
+            end = self.data_start + self.offsets[position + 1]
+        else:
+            end = len(self.mm)
+        return start, end
+
+    def key(self, position):
+        start, _ = self.bounds(position)
+        end = self.mm.find(SEPARATOR, start)
+        return self.mm[start:end]
+
+    def record(self, position):
+        start, end = self.bounds(position)
+        _, pk, name, unit = self.mm[start:end - 1].decode().split("\x1f")
+        return {"id": int(pk), "name": name, "measurement_unit": unit}
+
+    def position(self, offset):
+        """Номер записи, в которую попадает смещение в файле."""
+        return bisect.bisect_right(self.offsets, offset - self.data_start) - 1
+
+    def search(self, needle, limit):
+        keys = _Keys(self)
+        position = bisect.bisect_left(keys, needle)
+        prefix = []
+        while (
+            position < len(self)
+            and len(prefix) < limit
+            and keys[position].startswith(needle)
+        ):
+            prefix.append(position)
+            position += 1
+
+        substring = []
+        if len(prefix) < limit:
+            offset = self.mm.find(needle, self.data_start)
+            while offset != -1:
+                position = self.position(offset)
+                start, end = self.bounds(position)
+                key_end = self.mm.find(SEPARATOR, start)
+                if start < offset and offset + len(needle) <= key_end:
+                    substring.append(
+                        (offset - start, key_end - start, position)
+                    )
+                offset = self.mm.find(needle, end)
+            substring.sort()
+
+        found = prefix + [
+            position for _, _, position in substring[: limit - len(prefix)]
+        ]
+        return [self.record(position) for position in found]
+
+    def fuzzy_search(self, queries, limit):
+        best = {}
+        for query in queries:
+            for rank in self.trigrams.search(query, limit, FUZZY_THRESHOLD):
+                position = rank[-1]
+                best[position] = min(best.get(position, rank), rank)
+        found = sorted(best.values())[:limit]
+        return [self.record(position) for *_, position in found]
+
+
+class IngredientIndex:
+    """Отсортированный индекс ингредиентов в файле, общем для воркеров."""
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = Generation("ingredient-index")
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def build(self, generation):
+        """Строит файл индекса по таблице ингредиентов.
+
+        Файл сохраняется, только если за время сборки поколение не
+        сменилось; снимок собранного индекса возвращается в любом случае.
+        """
+        from recipes.models import Ingredient
+
+        records = sorted(
+            (normalize(name), f"{pk}\x1f{name}\x1f{measurement_unit}")
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                "id", "name", "measurement_unit"
+            )
+        )
+        offsets, chunks, position = [], [], 0
+        for key, payload in records:
+            chunk = f"{key}\x1f{payload}\n".encode()
+            offsets.append(position)
+            chunks.append(chunk)
+            position += len(chunk)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(HEADER.pack(MAGIC, len(offsets), generation.encode()))
+            file.writelines(OFFSET.pack(offset) for offset in offsets)
+            file.writelines(chunks)
+        snapshot = _Snapshot(tmp_path)
+        if generation == self.generation.current():
+            os.replace(tmp_path, self.path)
+        else:
+            os.remove(tmp_path)
+        return snapshot
+
+    def invalidate(self):
+        """Сбрасывает индекс на всех хостах: его перестроит первый поиск."""
+        self.generation.bump()
+
+    def snapshot(self):
+        """Версия индекса для текущего поколения данных."""
+        generation = self.generation.current()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.generation == generation:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.generation != generation:
+                try:
+                    snapshot = _Snapshot(self.path)
+                except (FileNotFoundError, ValueError):
+                    snapshot = None
+            if snapshot is None or snapshot.generation != generation:
+                snapshot = self.build(generation)
+            self._snapshot = snapshot
+            return snapshot
+
+    def search(self, query, limit=INGREDIENT_SEARCH_LIMIT):
+        """Сначала совпадения по началу названия, затем по подстроке."""
+        needle = normalize(query).encode()
+        if not needle:
+            return []
+        return self.snapshot().search(needle, limit)
+
+    def fuzzy_search(self, query, limit=INGREDIENT_SEARCH_LIMIT):
+        """Похожие названия с учетом опечаток и неверной раскладки."""
+        query = normalize(query)
+        if not query:
+            return []
+        return self.snapshot().fuzzy_search(layout_variants(query), limit)
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_PATH)
@@ -0,0 +1,90 @@
+"""Короткие ссылки на рецепты без обращения к БД.
+
+Код — base62-запись id рецепта, предварительно перемешанного обратимой
+перестановкой (сеть Фейстеля с ключом SHORT_LINK_KEY). Перестановка
+взаимно однозначна, поэтому коды не совпадают, а по коду id
+восстанавливается без запроса. Смена ключа делает выданные ссылки
+недействительными.
+
+Новые коды длиной SHORT_CODE_LENGTH, старые (первые символы uuid4)
+длиной SHORT_LINK_LENGTH, поэтому их легко различить.
+"""
+import hashlib
+import string
+
+from django.conf import settings
+
+from recipes.constants import SHORT_CODE_LENGTH
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+DIGITS = {char: value for value, char in enumerate(ALPHABET)}
+
+DOMAIN = BASE**SHORT_CODE_LENGTH
+HALF_BITS = (DOMAIN.bit_length() + 1) // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+def _round_keys():
+    key = settings.SHORT_LINK_KEY.encode()
+    return [
+        hashlib.blake2b(key, digest_size=16, person=b"round%d" % number)
+        for number in range(ROUNDS)
+    ]
+
+
+ROUND_KEYS = _round_keys()
+HALF_BYTES = (HALF_BITS + 7) // 8
+
+
+def _mix(number, half):
+    digest = ROUND_KEYS[number].copy()
+    digest.update(half.to_bytes(HALF_BYTES, "big"))
+    return int.from_bytes(digest.digest()[:HALF_BYTES], "big") & HALF_MASK
+
+
+def _permute(value):
+    """Сеть Фейстеля с перебором по циклу, чтобы не выйти за DOMAIN."""
+    while True:
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for number in range(ROUNDS):
+            left, right = right, left ^ _mix(number, right)
+        value = (left << HALF_BITS) | right
+        if value < DOMAIN:
+            return value
+
+
+def _unpermute(value):
+    while True:
+        left, right = value >> HALF_BITS, value & HALF_MASK
+        for number in reversed(range(ROUNDS)):
+            left, right = right ^ _mix(number, left), left
+        value = (left << HALF_BITS) | right
+        if value < DOMAIN:
+            return value
+
+
+def encode(pk):
+    """Код короткой ссылки для id рецепта."""
+    if not 0 <= pk < DOMAIN:
+        raise ValueError(f"id {pk} не помещается в короткую ссылку.")
+    value = _permute(pk)
+    chars = []
+    for _ in range(SHORT_CODE_LENGTH):
+        value, digit = divmod(value, BASE)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(code):
+    """id рецепта по коду или None, если это не код нового формата."""
+    if len(code) != SHORT_CODE_LENGTH:
+        return None
+    value = 0
+    for char in code:
+        digit = DIGITS.get(char)
+        if digit is None:
+            return None
+        value = value * BASE + digit
+    return _unpermute(value)
@@ -0,0 +1,219 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from jobs.models import Job
+from recipes.generations import recipes_generation
+from recipes.images import render_variants, stored_names
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.search import ingredient_index
+
+User = get_user_model()
+
+# Отправляется после массового импорта: bulk_create не шлет post_save.
+ingredients_imported = Signal()
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счетчик на delta, не опуская его ниже нуля."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f"{field}__gte": -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def touch(queryset, field):
+    """Обновляет отметку времени изменения, по которой строятся ETag."""
+    queryset.update(**{field: timezone.now()})
+    if queryset.model is Recipe:
+        transaction.on_commit(recipes_generation.bump)
+
+
+def reset_variants(instance, field, update_fields=None):
+    """Сбрасывает заглушку, если изображение заменено или удалено.
+
+    Если загружен новый файл, имя прежнего запоминается, чтобы после
+    сохранения удалить его вместе с вариантами. Очистку поля без замены
+    обрабатывает тот, кто ее делает, как AvatarUpdateView.delete: иначе
+    за прежним именем пришлось бы ходить в БД при каждом сохранении.
+    """
+    file = getattr(instance, field)
+    if not file or not file._committed:
+        setattr(instance, f"{field}_placeholder", "")
+        instance._variants_pending = bool(file)
+        if (
+            file
+            and not instance._state.adding
+            and (update_fields is None or field in update_fields)
+        ):
+            instance._replaced_file = (
+                type(instance)
+                ._base_manager.filter(pk=instance.pk)
+                .values_list(field, flat=True)
+                .first()
+            )
+
+
+def delete_files(name):
+    """Ставит в очередь удаление файла name и его вариантов."""
+    if name:
+        Job.objects.enqueue("images.delete_files", names=stored_names(name))
+
+
+def enqueue_variants(instance, field):
+    """Ставит в очередь задачи для сохраненного изображения.
+
+    Замененный файл удаляется вместе с вариантами, для загруженного
+    строятся варианты.
+    """
+    replaced = instance.__dict__.pop("_replaced_file", None)
+    if replaced != getattr(instance, field).name:
+        delete_files(replaced)
+    if getattr(instance, "_variants_pending", False):
+        instance._variants_pending = False
+        Job.objects.enqueue(
+            "images.build_variants",
+            model=instance._meta.label,
+            pk=instance.pk,
+            field=field,
+        )
+
+
+def build_variants(instance, field):
+    """Строит варианты изображения без заглушки; True, если построены."""
+    file = getattr(instance, field)
+    placeholder_field = f"{field}_placeholder"
+    if not file or getattr(instance, placeholder_field):
+        return False
+    try:
+        placeholder = render_variants(file.storage, file.name)
+    except OSError:
+        # Файл не читается как изображение: в ответе останется оригинал.
+        return False
+    setattr(instance, placeholder_field, placeholder)
+    type(instance).objects.filter(pk=instance.pk).update(
+        **{placeholder_field: placeholder}
+    )
+    return True
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта в сводный список покупок."""
+    if created:
+        ShoppingListItem.objects.apply_deltas(
+            [instance.user_id],
+            IngredientRecipe.objects.amounts(instance.recipe_id),
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    """Вычитает ингредиенты рецепта из сводного списка покупок.
+
+    pre_delete, а не post_delete: при каскадном удалении рецепта его
+    ингредиенты к моменту post_delete уже могут быть удалены.
+    """
+    amounts = IngredientRecipe.objects.amounts(instance.recipe_id)
+    ShoppingListItem.objects.apply_deltas(
+        [instance.user_id],
+        {ingredient_id: -amount for ingredient_id, amount in amounts.items()},
+    )
+
+
+@receiver(ingredients_imported)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Сбрасывает индекс поиска ингредиентов после коммита."""
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+def count_new_recipe(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, "recipes_count", 1)
+
+
+@receiver(post_save, sender=Recipe)
+def enqueue_fan_out(sender, instance, created, **kwargs):
+    """Ставит в очередь доставку нового рецепта в ленты подписчиков."""
+    if created:
+        Job.objects.enqueue("feed.fan_out", recipe_id=instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    change_counter(User, instance.author_id, "recipes_count", -1)
+
+
+@receiver(post_save, sender=Favorite)
+def count_new_favorite(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, "favorites_count", 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def count_deleted_favorite(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, "favorites_count", -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def count_new_cart_item(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, "in_carts_count", 1)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def count_deleted_cart_item(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, "in_carts_count", -1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def touch_user_state(sender, instance, **kwargs):
+    touch(User.objects.filter(pk=instance.user_id), "state_changed_at")
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def touch_tag_recipes(sender, instance, **kwargs):
+    touch(Recipe.objects.filter(tags=instance), "updated_at")
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created, **kwargs):
+    if not created:
+        touch(
+            Recipe.objects.filter(recipe_ingredients__ingredient=instance),
+            "updated_at",
+        )
+
+
+@receiver(pre_save, sender=Recipe)
+def reset_image_variants(sender, instance, update_fields, **kwargs):
+    reset_variants(instance, "image", update_fields)
+
+
+@receiver(post_save, sender=Recipe)
+def enqueue_image_variants(sender, instance, **kwargs):
+    enqueue_variants(instance, "image")
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_image_files(sender, instance, **kwargs):
+    delete_files(instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipes_generation(sender, **kwargs):
+    """Список рецептов изменился: его ETag сменится после коммита."""
+    transaction.on_commit(recipes_generation.bump)
@@ -0,0 +1,89 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from jobs.registry import task
+from recipes.models import Recipe, TimelineEntry
+from recipes.signals import build_variants, touch
+from users.models import Subscription, User
+
+
+@task("images.build_variants")
+def build_image_variants(model, pk, field):
+    """Строит варианты изображения и обновляет версии рецептов с ним."""
+    instance = apps.get_model(model).objects.filter(pk=pk).first()
+    if instance is None or not build_variants(instance, field):
+        return {"built": False}
+    if isinstance(instance, Recipe):
+        recipes = Recipe.objects.filter(pk=pk)
+    else:
+        recipes = Recipe.objects.filter(author_id=pk)
+    touch(recipes, "updated_at")
+    return {"built": True}
+
+
+@task("images.delete_files")
+def delete_files(names):
+    """Удаляет файлы из хранилища, например замененный аватар."""
+    for name in names:
+        default_storage.delete(name)
+    return {"deleted": len(names)}
+
+
+def deliver_to_subscribers(author_id, recipes):
+    """Доставляет рецепты автора в ленты его подписчиков."""
+    subscribers = (
+        Subscription.objects.filter(subscribed_to_id=author_id)
+        .order_by("id")
+        .values_list("user_id", flat=True)
+    )
+    return sum(
+        TimelineEntry.objects.deliver(
+            recipe,
+            subscribers.iterator(chunk_size=settings.FEED_FANOUT_BATCH),
+            settings.FEED_FANOUT_BATCH,
+        )
+        for recipe in recipes
+    )
+
+
+def is_celebrity(author_id):
+    return User.objects.filter(
+        pk=author_id,
+        subscribers_count__gte=settings.FEED_CELEBRITY_THRESHOLD,
+    ).exists()
+
+
+@task("feed.fan_out")
+def fan_out(recipe_id):
+    """Доставляет новый рецепт в ленты подписчиков автора.
+
+    Рецепты авторов, у которых не меньше FEED_CELEBRITY_THRESHOLD
+    подписчиков, не копируются: лента подмешивает их при чтении.
+    """
+    recipe = (
+        Recipe.objects.filter(pk=recipe_id).only("id", "author_id").first()
+    )
+    if recipe is None or is_celebrity(recipe.author_id):
+        return {"delivered": 0}
+    return {"delivered": deliver_to_subscribers(recipe.author_id, [recipe])}
+
+
+@task("feed.refill")
+def refill(author_id):
+    """Возвращает в ленты рецепты автора, который перестал быть знаменитым.
+
+    Пока у автора было не меньше FEED_CELEBRITY_THRESHOLD подписчиков,
+    его рецепты не копировались в ленты. Когда подписчиков стало меньше,
+    лента снова читает автора из TimelineEntry, поэтому его последние
+    FEED_BACKFILL_LIMIT рецептов доставляются подписчикам, как при
+    подписке.
+    """
+    if is_celebrity(author_id):
+        return {"delivered": 0}
+    recipes = (
+        Recipe.objects.filter(author_id=author_id)
+        .only("id")
+        .order_by("-pub_date", "-id")[: settings.FEED_BACKFILL_LIMIT]
+    )
+    return {"delivered": deliver_to_subscribers(author_id, recipes)}
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:48
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def counted(model, field):
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(**{field: models.OuterRef('pk')})
+            .values(field)
+            .annotate(total=models.Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscription = apps.get_model('users', 'Subscription')
+    User.objects.update(
+        recipes_count=counted(Recipe, 'author'),
+        subscribers_count=counted(Subscription, 'subscribed_to'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_alter_user_email'),
+        ('recipes', '0007_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='state_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Изменение избранного, корзины и подписок'),
+        ),
+    ]
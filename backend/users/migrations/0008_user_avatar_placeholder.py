@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_state_changed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Заглушка аватара'),
+        ),
+    ]
@@ -1,12 +1,40 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from django.db import models
+from django.utils import timezone
 
 from users.constants import (EMAIL_MAX_LENGTH, NAME_MAX_LENGTH,
                              PASSWORD_MAX_LENGTH)
 
 
-class User(AbstractUser):
+class PreservedFieldsMixin:
+    """Полное сохранение не перезаписывает поля из preserved_fields.
+
+    Такие поля меняются только атомарными UPDATE (F() в сигналах), и
+    значение из памяти давно загруженного объекта затерло бы чужие
+    изменения. Явный update_fields и создание объекта работают как обычно.
+    """
+
+    preserved_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and not self._state.adding
+            and kwargs.get("update_fields") is None
+        ):
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.preserved_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(PreservedFieldsMixin, AbstractUser):
     email = models.EmailField(
         "Электронная почта", max_length=EMAIL_MAX_LENGTH, unique=True
     )
@@ -22,6 +50,26 @@ class User(AbstractUser):
     avatar = models.ImageField(
         upload_to="users/", null=True, blank=True, verbose_name="Аватар"
     )
+    avatar_placeholder = models.TextField(
+        "Заглушка аватара", blank=True, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        "Количество рецептов", default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        "Количество подписчиков", default=0, editable=False
+    )
+    state_changed_at = models.DateTimeField(
+        "Изменение избранного, корзины и подписок",
+        default=timezone.now,
+        editable=False,
+    )
+
+    preserved_fields = (
+        "recipes_count",
+        "subscribers_count",
+        "state_changed_at",
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name"]
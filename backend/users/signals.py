@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from jobs.models import Job
+from recipes.models import Recipe, TimelineEntry
+from recipes.signals import (change_counter, delete_files, enqueue_variants,
+                             reset_variants, touch)
+from users.models import Subscription, User
+
+
+@receiver(post_save, sender=Subscription)
+def count_new_subscriber(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.subscribed_to_id, "subscribers_count", 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted_subscriber(sender, instance, **kwargs):
+    change_counter(User, instance.subscribed_to_id, "subscribers_count", -1)
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_timeline(sender, instance, created, **kwargs):
+    """Новая подписка сразу видна в ленте: берем последние рецепты."""
+    if created:
+        TimelineEntry.objects.backfill(
+            instance.user_id,
+            instance.subscribed_to_id,
+            settings.FEED_BACKFILL_LIMIT,
+        )
+
+
+@receiver(post_delete, sender=Subscription)
+def clear_timeline(sender, instance, **kwargs):
+    TimelineEntry.objects.filter(
+        user_id=instance.user_id, author_id=instance.subscribed_to_id
+    ).delete()
+
+
+@receiver(post_delete, sender=Subscription)
+def refill_timelines(sender, instance, **kwargs):
+    """Автор опустился ниже FEED_CELEBRITY_THRESHOLD: заполняем ленты.
+
+    Удаление идет в транзакции, и строка автора заблокирована
+    уменьшением счетчика, поэтому переход через порог видит ровно одна
+    отписка.
+    """
+    if User.objects.filter(
+        pk=instance.subscribed_to_id,
+        subscribers_count=settings.FEED_CELEBRITY_THRESHOLD - 1,
+    ).exists():
+        Job.objects.enqueue("feed.refill", author_id=instance.subscribed_to_id)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def touch_user_state(sender, instance, **kwargs):
+    touch(User.objects.filter(pk=instance.user_id), "state_changed_at")
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    """Профиль автора входит в ответ с рецептом: меняем и его версию."""
+    if created or update_fields == frozenset(["last_login"]):
+        return
+    touch(Recipe.objects.filter(author=instance), "updated_at")
+
+
+@receiver(pre_save, sender=User)
+def reset_avatar_variants(sender, instance, update_fields, **kwargs):
+    reset_variants(instance, "avatar", update_fields)
+
+
+@receiver(post_save, sender=User)
+def enqueue_avatar_variants(sender, instance, **kwargs):
+    enqueue_variants(instance, "avatar")
+
+
+@receiver(post_delete, sender=User)
+def delete_avatar_files(sender, instance, **kwargs):
+    delete_files(instance.avatar.name)